@@ -0,0 +1,271 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+"""Local http server imitating the markup of every site getmanga supports.
+
+Each site lives under its own prefix, e.g. http://127.0.0.1:8000/mangahere,
+set that as the site's site_uri. Titles are accepted whatever their name."""
+
+import argparse
+import hashlib
+import random
+import sys
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+
+class FakeSites(object):
+    """Builds the pages of every site for a base url"""
+    def __init__(self, chapters=5, pages=12, image_kb=200, filler_kb=20):
+        self.chapters = chapters
+        self.pages = pages
+        self.image_kb = image_kb
+        self.filler = '<p>{0}</p>'.format('lorem ipsum ' * 80) * max(filler_kb, 0)
+        self._image_body = None
+
+    def page(self, base, path, query):
+        """Returns html of path, None if there is no such page"""
+        parts = [part for part in path.split('/') if part]
+        if not parts or not hasattr(self, '_' + parts[0]):
+            return None
+        site_uri = '{0}/{1}'.format(base, parts[0])
+        try:
+            return getattr(self, '_' + parts[0])(base, site_uri, parts[1:], query)
+        except (ValueError, IndexError):
+            return None
+
+    def image(self, path):
+        """Returns bytes of /img/site/chapter/page.jpg, every page differs a bit"""
+        if self._image_body is None:
+            block = hashlib.sha1(b'getmanga').digest()
+            self._image_body = (block * (self.image_kb * 1024 // len(block) + 1))[:self.image_kb * 1024]
+        seed = hashlib.sha1(path.encode('utf8')).digest()
+        return b'\xff\xd8\xff\xe0' + seed + self._image_body + b'\xff\xd9'
+
+    def _numbers(self, descending=True):
+        numbers = list(range(1, self.chapters + 1))
+        return numbers[::-1] if descending else numbers
+
+    def _options(self, template='{0}'):
+        return ''.join('<option value="{0}">{1}</option>'.format(n, template.format(n))
+                       for n in range(1, self.pages + 1))
+
+    def _check(self, chapter, page=1):
+        if not (1 <= int(chapter) <= self.chapters and 1 <= int(page) <= self.pages):
+            raise ValueError('no such page')
+
+    def _html(self, *body):
+        return '<html><head><title>bench</title></head><body>{0}{1}{0}</body></html>'.format(
+            self.filler, ''.join(body))
+
+    @staticmethod
+    def _src(base, site, chapter, page):
+        return '{0}/img/{1}/{2}/{3:03d}.jpg'.format(base, site, int(chapter), int(page))
+
+    def _mangahere(self, base, site_uri, parts, query):
+        if parts[0] != 'manga':
+            return None
+        title = parts[1]
+        if len(parts) == 2:
+            links = ''.join('<li><a href="{0}/manga/{1}/c{2:03d}/">{1} {2}</a></li>'.format(site_uri, title, n)
+                            for n in self._numbers())
+            return self._html('<div class="detail_list"><ul>', links, '</ul></div>')
+        chapter = parts[2][1:]
+        page = parts[3].split('.')[0] if len(parts) > 3 else 1
+        self._check(chapter, page)
+        return self._html('<section class="readpage_top"><div class="go_page"><select>',
+                          self._options(), '</select></div></section>',
+                          '<img id="image" src="{0}"/>'.format(self._src(base, 'mangahere', chapter, page)))
+
+    def _mangafox(self, base, site_uri, parts, query):
+        if parts[0] != 'manga':
+            return None
+        title = parts[1]
+        if len(parts) == 2:
+            links = ''.join('<a class="tips" href="{0}/manga/{1}/v{2:02d}/c{3:03d}/1.html">{1} {3}</a>'.format(
+                site_uri, title, (n - 1) // 10 + 1, n) for n in self._numbers())
+            return self._html('<ul>', links, '</ul>')
+        chapter = parts[3][1:]
+        page = parts[4].split('.')[0]
+        self._check(chapter, page)
+        # the chapter's page is its first page
+        return self._html('<div id="top_bar"><select>', self._options(), '<option>Comments</option></select></div>',
+                          '<img id="image" src="{0}"/>'.format(self._src(base, 'mangafox', chapter, page)))
+
+    def _mangareader(self, base, site_uri, parts, query):
+        if parts[0] == 'alphabetical':
+            return self._html('<ul><li><a href="/103/some-other-title.html">Other</a></li></ul>')
+        title = parts[0]
+        if len(parts) == 1:
+            links = ''.join('<tr><td><a href="/{0}/{1}">{0} {1}</a></td></tr>'.format(title, n)
+                            for n in self._numbers(descending=False))
+            return self._html('<table id="chapterlist">', links, '</table>')
+        chapter = parts[1]
+        page = parts[2] if len(parts) > 2 else 1
+        self._check(chapter, page)
+        return self._html('<div id="selectpage"><select>', self._options(), '</select></div>',
+                          '<img id="img" src="{0}"/>'.format(self._src(base, 'mangareader', chapter, page)))
+
+    def _mangastream(self, base, site_uri, parts, query):
+        if parts[0] == 'manga':
+            links = ''.join('<tr><td><a href="{0}/r/{1}/{2:03d}/{3}/1">{2} - The Chapter</a></td></tr>'.format(
+                site_uri, parts[1], n, 4000 + n) for n in self._numbers())
+            return self._html('<table>', links, '</table>')
+        chapter, page = parts[2], parts[4]
+        self._check(chapter, page)
+        return self._html('<div class="btn-group"><ul class="dropdown-menu">',
+                          '<li><a href="#">First Page (1)</a></li>',
+                          '<li><a href="#">Last Page ({0})</a></li></ul></div>'.format(self.pages),
+                          '<img id="manga-page" src="{0}"/>'.format(self._src(base, 'mangastream', chapter, page)))
+
+    def _mangadex(self, base, site_uri, parts, query):
+        if parts[0] == 'manga':
+            links = ''.join('<tr><td><a data-chapter-num="{0}" href="/chapter/{1}">Vol. 1 Ch. {0}</a></td></tr>'.format(
+                n, 1000 + n) for n in self._numbers())
+            return self._html('<div id="content"><table>', links, '</table></div>')
+        chapter = int(parts[1]) - 1000
+        page = parts[2] if len(parts) > 2 else 1
+        self._check(chapter, page)
+        files = ', '.join("'{0:03d}.jpg'".format(n) for n in range(1, self.pages + 1))
+        script = ("<script>var dataurl = '{0}';\nvar page_array = [\n{1}];\n"
+                  "var server = '{2}/img/mangadex/';</script>").format(chapter, files, base)
+        return self._html('<select id="jump_page">', self._options('Page {0}'), '</select>', script,
+                          '<div id="content"><img id="current_page" src="{0}"/></div>'.format(
+                              self._src(base, 'mangadex', chapter, page)))
+
+    def _cartoonmad(self, base, site_uri, parts, query):
+        name = parts[1].split('.')[0]
+        if len(name) <= 4:
+            # the title, chapters and pages are named title id + chapter + page
+            links = ''.join('<tr><td><a href="/comic/{0}{1:04d}0001.html">Chapter {1}</a></td></tr>'.format(name, n)
+                            for n in self._numbers(descending=False))
+            return self._html('<fieldset id="info"><table>', links, '</table></fieldset>')
+        prefix, chapter, page = name[:-8], name[-8:-4], name[-4:]
+        self._check(chapter, page)
+        options = ''.join('<option value="{0}{1}{2:04d}.html">Page {2}</option>'.format(prefix, chapter, n)
+                          for n in range(1, self.pages + 1))
+        return self._html('<table><tr><td><center><li><select>', options, '</select></li></center></td></tr></table>',
+                          '<table><tr><td align="center"><table><tr><td align="center"><a href="#">',
+                          '<img oncontextmenu="return false" src="{0}"/>'.format(
+                              self._src(base, 'cartoonmad', chapter, page)),
+                          '</a></td></tr></table></td></tr></table>')
+
+    def _rawmangaupdate(self, base, site_uri, parts, query):
+        title = parts[1]
+        if len(parts) == 2:
+            links = ''.join('<li><h5><a href="{0}/manga/{1}/{2}">{1} {2}</a></h5></li>'.format(site_uri, title, n)
+                            for n in self._numbers())
+            return self._html('<ul class="chapters">', links, '</ul>')
+        chapter = parts[2]
+        page = parts[3] if len(parts) > 3 else 1
+        self._check(chapter, page)
+        return self._html('<div class="page-nav"><select id="page-list">', self._options(), '</select></div>',
+                          '<div id="ppp"><img src="{0}"/></div>'.format(self._src(base, 'rawmangaupdate', chapter, page)))
+
+    def _webtoons(self, base, site_uri, parts, query):
+        if parts[-1] == 'list':
+            title_no = query.get('title_no', ['0'])[0]
+            links = ''.join('<li><a href="{0}/en/drama/{1}/ep{2}/viewer?title_no={3}&amp;episode_no={2}">Ep {2}</a></li>'.format(
+                site_uri, parts[0], n, title_no) for n in self._numbers())
+            return self._html('<div class="detail_lst"><ul>', links, '</ul></div>')
+        chapter = query['episode_no'][0]
+        self._check(chapter)
+        images = ''.join('<img class="_images" data-url="{0}"/>'.format(self._src(base, 'webtoons', chapter, n))
+                         for n in range(1, self.pages + 1))
+        return self._html('<div class="viewer_lst">', images, '</div>')
+
+    def _senmanga(self, base, site_uri, parts, query):
+        title = parts[0]
+        if len(parts) == 1:
+            links = ''.join('<div class="element"><a href="{0}/{1}/{2}/1">{1} {2}</a></div>'.format(site_uri, title, n)
+                            for n in self._numbers())
+            return self._html('<div><div id="content">', links, '</div></div>')
+        chapter = parts[1]
+        page = parts[2] if len(parts) > 2 else 1
+        self._check(chapter, page)
+        return self._html('<div><select name="page">', self._options(), '</select></div>',
+                          '<img id="picture" src="{0}"/>'.format(self._src(base, 'senmanga', chapter, page)))
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        options = self.server.options
+        uri = urlparse(self.path)
+        if options.latency:
+            time.sleep(random.uniform(0.5, 1.5) * options.latency / 1000.0)
+        if random.random() < options.throttle:
+            return self._send(429, b'slow down', {'Retry-After': str(options.retry_after)})
+        if random.random() < options.errors:
+            return self._send(503 if random.random() < 0.5 else 500, b'oops')
+
+        if uri.path.startswith('/img/'):
+            return self._send(200, self.server.sites.image(uri.path), {'Content-Type': 'image/jpeg'})
+        base = 'http://{0}'.format(self.headers.get('Host'))
+        content = self.server.sites.page(base, uri.path, parse_qs(uri.query))
+        if content is None:
+            return self._send(404, b'not found')
+        self._send(200, content.encode('utf8'), {'Content-Type': 'text/html; charset=utf-8'})
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # clients hanging up on unread bodies is expected
+        if not isinstance(sys.exc_info()[1], (IOError, OSError)):
+            HTTPServer.handle_error(self, request, client_address)
+
+
+def cmdparse(argv=None):
+    parser = argparse.ArgumentParser(description='Fake manga sites for benchmarks')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on, 0 picks a free one')
+    parser.add_argument('--chapters', type=int, default=5, help='chapters of every title')
+    parser.add_argument('--pages', type=int, default=12, help='pages of every chapter')
+    parser.add_argument('--image-kb', type=int, default=200, help='size of every image')
+    parser.add_argument('--filler-kb', type=int, default=20, help='filler text on every html page')
+    parser.add_argument('--latency', type=float, default=20, help='average ms before every response')
+    parser.add_argument('--errors', type=float, default=0, help='share of responses that are 500/503')
+    parser.add_argument('--throttle', type=float, default=0, help='share of responses that are 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='seconds asked for by 429 responses')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = cmdparse(argv)
+    server = Server(('127.0.0.1', options.port), Handler)
+    server.options = options
+    server.sites = FakeSites(options.chapters, options.pages, options.image_kb, options.filler_kb)
+    sys.stdout.write('listening on {0}\n'.format(server.server_address[1]))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+"""Downloads from the fake sites of fakesite.py and reports how fast it went.
+
+    python bench/run.py --latency 50 --throttle 0.05 --json before.json
+    python bench/run.py --latency 50 --throttle 0.05 --compare before.json
+
+Every scenario runs in its own process, so peak memory and cpu time are its own."""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+SCENARIOS = ('get', 'new', 'batch')
+
+# titles the sites' url schemes accept, one per site so batch sections differ
+TITLES = {'mangahere': 'mangahere bench',
+          'mangafox': 'mangafox bench',
+          'mangareader': 'mangareader bench',
+          'mangastream': 'mangastream bench',
+          'mangadex': 'mangadex bench:42',
+          'cartoonmad': 'cartoonmad bench:77',
+          'rawmangaupdate': 'rawmangaupdate bench',
+          'webtoons': 'webtoons-bench:en:55',
+          'senmanga': 'Senmanga Bench'}
+
+REPORT = ('{scenario:<6} {pages:>6} pages {pages_per_sec:>8.1f} pages/s  '
+          'p50 {p50_ms:>7.1f}ms  p99 {p99_ms:>7.1f}ms  '
+          'rss {max_rss_mb:>6.1f}MB  cpu {cpu_sec:>6.2f}s  wall {wall_sec:>6.2f}s  errors {errors}')
+
+
+def cmdparse(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark getmanga against local fake sites')
+    parser.add_argument('--sites', default=','.join(sorted(TITLES)),
+                        help='comma separated sites to download from (default: all)')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='GetManga.get of the latest chapter, getNewChapters, or a config '
+                             'file batch of every site (default: all three)')
+    parser.add_argument('--jobs', type=int, default=3, help='jobs of the batch scenario')
+    parser.add_argument('--chapters', type=int, default=5)
+    parser.add_argument('--pages', type=int, default=12)
+    parser.add_argument('--image-kb', type=int, default=200)
+    parser.add_argument('--filler-kb', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=20, help='average ms per response')
+    parser.add_argument('--errors', type=float, default=0, help='share of 500/503 responses')
+    parser.add_argument('--throttle', type=float, default=0, help='share of 429 responses')
+    parser.add_argument('--json', metavar='FILE', help='save the results to compare with later')
+    parser.add_argument('--compare', metavar='FILE', help='results of an earlier run to compare with')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--base', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = cmdparse(argv)
+    if options.child:
+        return child(options)
+
+    server = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'fakesite.py'), '--port', '0',
+                               '--chapters', str(options.chapters), '--pages', str(options.pages),
+                               '--image-kb', str(options.image_kb), '--filler-kb', str(options.filler_kb),
+                               '--latency', str(options.latency), '--errors', str(options.errors),
+                               '--throttle', str(options.throttle)],
+                              stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        port = server.stdout.readline().split()[-1]
+        base = 'http://127.0.0.1:{0}'.format(port)
+        results = []
+        for scenario in options.scenario or SCENARIOS:
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', scenario,
+                                              '--base', base, '--sites', options.sites,
+                                              '--jobs', str(options.jobs)], universal_newlines=True)
+            result = json.loads(output.strip().splitlines()[-1])
+            results.append(result)
+            sys.stdout.write(REPORT.format(**result) + '\n')
+    finally:
+        server.terminate()
+        server.wait()
+
+    if options.compare:
+        with open(options.compare) as f:
+            earlier = dict((result['scenario'], result) for result in json.load(f))
+        for result in results:
+            if result['scenario'] in earlier:
+                compare(earlier[result['scenario']], result)
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+def compare(earlier, result):
+    """Prints how result changed since earlier"""
+    changes = []
+    for key in ('pages_per_sec', 'p50_ms', 'p99_ms', 'max_rss_mb', 'cpu_sec'):
+        if earlier[key]:
+            changes.append('{0} {1:+.1f}%'.format(key, (result[key] - earlier[key]) * 100.0 / earlier[key]))
+    sys.stdout.write('{0:<6} vs earlier: {1}\n'.format(result['scenario'], ', '.join(changes)))
+
+
+def child(options):
+    """Runs one scenario, prints its results as json"""
+    from getmanga import SITES, GetManga
+
+    sites = [site.strip() for site in options.sites.split(',') if site.strip()]
+    for site in sites:
+        SITES[site].site_uri = '{0}/{1}'.format(options.base, site)
+
+    latencies = []
+    get_image = GetManga._get_image
+
+    def timed_get_image(self, job, page, uri=None):
+        start = time.time()
+        result = get_image(self, job, page, uri)
+        latencies.append(time.time() - start)
+        return result
+    GetManga._get_image = timed_get_image
+
+    errors = []
+    out_dir = tempfile.mkdtemp(prefix='getmanga-bench-')
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+    try:
+        if options.child == 'batch':
+            batch(options, sites, out_dir)
+        else:
+            for site in sites:
+                try:
+                    manga = GetManga(site, TITLES[site])
+                    manga.path = os.path.join(out_dir, site)
+                    manga.show_progress = False
+                    if options.child == 'get':
+                        manga.get(manga.latest)
+                    else:
+                        manga.getNewChapters()
+                except Exception as msg:
+                    errors.append('{0}: {1}'.format(site, msg))
+        wall = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # kilobytes on linux, bytes on mac
+    max_rss = usage.ru_maxrss / 1024.0
+    if sys.platform == 'darwin':
+        max_rss /= 1024.0
+    latencies.sort()
+    for error in errors:
+        sys.stderr.write(error + '\n')
+    sys.stdout.write(json.dumps({'scenario': options.child,
+                                 'pages': len(latencies),
+                                 'pages_per_sec': len(latencies) / wall if wall else 0,
+                                 'p50_ms': percentile(latencies, 0.50) * 1000,
+                                 'p99_ms': percentile(latencies, 0.99) * 1000,
+                                 'max_rss_mb': max_rss,
+                                 'cpu_sec': usage.ru_utime + usage.ru_stime,
+                                 'wall_sec': wall,
+                                 'errors': len(errors)}) + '\n')
+
+
+def batch(options, sites, out_dir):
+    """Downloads every site's title through a config file, like getmanga -f"""
+    from getmanga import cli
+
+    config_file = os.path.join(out_dir, 'bench.ini')
+    with open(config_file, 'w') as f:
+        f.write('[GetManga]\nbase_dir: {0}\njobs: {1}\n'.format(os.path.join(out_dir, 'library'), options.jobs))
+        for site in sites:
+            f.write('\n[{0}]\nsite: {1}\nchapters: all\n'.format(TITLES[site], site))
+    argv = sys.argv
+    sys.argv = ['getmanga', '-f', config_file]
+    try:
+        cli.main()
+    finally:
+        sys.argv = argv
+
+
+def percentile(values, share):
+    """Returns the value share of the sorted values are below"""
+    if not values:
+        return 0
+    return values[min(int(round(share * (len(values) - 1))), len(values) - 1)]
+
+
+if __name__ == '__main__':
+    main()
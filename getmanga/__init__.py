@@ -5,39 +5,372 @@
 
 from __future__ import division
 
+import atexit
+import hashlib
+import json
 import os
 import re
+import shutil
+import struct
 import sys
-from time import sleep
+from tempfile import SpooledTemporaryFile
+from time import localtime, sleep, time
 
 if sys.version_info >= (3, 0, 0):
-    from queue import Queue
+    from queue import Empty, PriorityQueue
 else:
-    from Queue import Queue
+    from Queue import Empty, PriorityQueue
 
 from collections import namedtuple
-from threading import Semaphore, Thread
-from zipfile import ZIP_DEFLATED, ZipFile
+from io import BytesIO
+from itertools import count
+from threading import BoundedSemaphore, Event, Lock, Thread
+from weakref import WeakSet
+from zipfile import ZIP64_LIMIT, ZIP_DEFLATED, ZIP_STORED, BadZipfile, ZipFile, ZipInfo
 
 import requests
-from lxml import html
+from lxml import etree, html
+from lxml.cssselect import CSSSelector
+from requests.adapters import HTTPAdapter
+
+from getmanga.metrics import Metrics
+from getmanga.retry import RetryPolicy
 
 
 Chapter = namedtuple('Chapter', 'number name uri volume')
 Page = namedtuple('Page', 'name uri')
 
+# image types deflate can't make noticeably smaller, with their signatures
+COMPRESSED_IMAGES = (('jpeg', (b'\xff\xd8\xff',)),
+                     ('png', (b'\x89PNG\r\n\x1a\n',)),
+                     ('gif', (b'GIF87a', b'GIF89a')),
+                     ('webp', (b'RIFF',)))
+
+# what an archive entry copied into another archive keeps of its ZipInfo
+ZIPINFO_FIELDS = ('compress_type', 'comment', 'extra', 'create_system', 'create_version',
+                  'extract_version', 'reserved', 'flag_bits', 'volume', 'internal_attr',
+                  'external_attr', 'CRC', 'compress_size', 'file_size')
+
+# patterns the site classes use on every chapter and page, compiled once
+LAST_NUMBER = re.compile(r'\b([0-9]+)\b[^0-9]*$')
+LAST_DECIMAL = re.compile(r'\b([0-9][0-9.]*)\b[^0-9]*$')
+NUMBER = re.compile('([0-9]+)')
+VOLUME = re.compile('/(v[0-9.]+)/c[0-9]')
+EPISODE_NO = re.compile('episode_no=([0-9]+)')
+SENMANGA_HREF = re.compile('a href="[^"]*/([0-9]+)/1?"')
+# the element a selector like "div img#image" points at
+TARGET_TAG = re.compile(r'([a-zA-Z][a-zA-Z0-9]*)[^\s>+~]*$')
+
 class MangaException(Exception):
     """Exception class for manga"""
     pass
 
 
+class Task(object):
+    """A function call queued on a WorkerPool"""
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.cancelled = False
+        # when the task was queued and when a worker picked it up
+        self.queued = time()
+        self.started = None
+        self._done = Event()
+        self._result = None
+        self._error = None
+
+    def run(self):
+        self.started = time()
+        if not self.cancelled:
+            try:
+                self._result = self.func(*self.args)
+            except Exception as msg:
+                self._error = msg
+        self._done.set()
+
+    def peek(self):
+        """Returns the result if the task has finished without error, else None"""
+        if self._done.is_set() and self._error is None:
+            return self._result
+        return None
+
+    def result(self):
+        """Waits for the task and returns its result or raises its error"""
+        self._done.wait()
+        if self.cancelled:
+            raise MangaException("Download cancelled")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class WorkerPool(object):
+    """Threads running queued tasks, lowest priority first"""
+    # seconds an idle worker waits for work before it goes away
+    idle_timeout = 30
+
+    def __init__(self, size):
+        self.size = size
+        self._tasks = PriorityQueue()
+        self._counter = count()
+        self._workers = 0
+        self._threads = []
+        self._lock = Lock()
+        _pools.add(self)
+
+    def submit(self, priority, func, *args):
+        """Queues func(*args), returns its Task"""
+        task = Task(func, args)
+        # the counter keeps tasks of the same priority in order
+        self._tasks.put((priority, next(self._counter), task))
+        with self._lock:
+            if self._workers < self.size:
+                self._workers += 1
+                thread = Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads = [t for t in self._threads if t.is_alive()] + [thread]
+        return task
+
+    def close(self):
+        """Drops queued tasks and stops the workers"""
+        while True:
+            try:
+                _, _, task = self._tasks.get_nowait()
+            except Empty:
+                break
+            if task is not None:
+                task.cancelled = True
+                task.run()
+        with self._lock:
+            threads = self._threads
+            for _ in threads:
+                self._tasks.put(((2,), next(self._counter), None))
+        for thread in threads:
+            # don't hang around for a worker stuck in a request
+            thread.join(1)
+
+    def _work(self):
+        while True:
+            try:
+                _, _, task = self._tasks.get(timeout=self.idle_timeout)
+            except Empty:
+                with self._lock:
+                    if self._tasks.empty():
+                        self._workers -= 1
+                        return
+                continue
+            if task is None:
+                with self._lock:
+                    self._workers -= 1
+                return
+            task.run()
+
+
+# workers wait on their queue with a timeout, which python 2 doesn't like
+# during interpreter shutdown, so stop them before that.
+_pools = WeakSet()
+
+
+@atexit.register
+def _close_pools():
+    for pool in list(_pools):
+        pool.close()
+
+
+class PageBuffer(object):
+    """Keeps downloaded pages in memory up to a limit and the rest in temporary files"""
+    def __init__(self, limit, workers):
+        self.limit = limit
+        self.used = 0
+        # pages still downloading and pages waiting to be written to their
+        # archive each get half of the limit.
+        self.spool_size = max(limit // (2 * max(workers, 1)), 1)
+        # page file -> bytes of it counted in used
+        self._buffered = {}
+        self._lock = Lock()
+
+    def spool(self):
+        """Returns a file to download a page into"""
+        return SpooledTemporaryFile(max_size=self.spool_size)
+
+    def keep(self, image):
+        """Holds a downloaded page until it is written, in memory if it fits"""
+        # wherever the download or transcoder left it
+        image.seek(0, 2)
+        size = image.tell()
+        image.seek(0)
+        with self._lock:
+            # pages bigger than spool_size went to disk while downloading
+            if size > self.spool_size or self.used + size > self.limit // 2:
+                image.rollover()
+            else:
+                self.used += size
+                self._buffered[image] = size
+
+    def buffered(self, image):
+        """Returns the bytes of a kept page held in memory, 0 if it's on disk"""
+        with self._lock:
+            return self._buffered.get(image, 0)
+
+    def release(self, image):
+        """Frees a page once it has been written (or is no longer needed)"""
+        with self._lock:
+            self.used -= self._buffered.pop(image, 0)
+        image.close()
+
+
+class Checkpoint(object):
+    """Pages of a chapter saved by a failed download, for the next attempt"""
+    def __init__(self, cbz_file):
+        self.part_file = '{0}.part'.format(cbz_file)
+        self.manifest_file = '{0}.json'.format(self.part_file)
+        # page name -> archive entry of the pages we have
+        self.pages = {}
+        self.archive = None
+
+        if not os.path.isfile(self.manifest_file):
+            return
+        try:
+            with open(self.manifest_file) as f:
+                pages = json.load(f)['pages']
+            self.archive = ZipFile(self.part_file)
+            names = set(self.archive.namelist())
+            self.pages = dict((page, entry) for page, entry in pages.items() if entry in names)
+        except Exception:
+            # unusable, start over
+            self.remove()
+
+    def copy(self, page_name, cbz):
+        """Writes a saved page to cbz, returns its entry name"""
+        entry = self.pages[page_name]
+        zinfo = self.archive.getinfo(entry)
+        with self.archive.open(zinfo) as image:
+            write_page(cbz, entry, image, zinfo.compress_type)
+        return entry
+
+    def save(self, cbz_tmp, pages):
+        """Keeps the finished archive cbz_tmp holding pages (name -> entry)"""
+        self.close()
+        if not pages:
+            os.remove(cbz_tmp)
+            self.remove()
+            return
+        if os.name == 'nt' and os.path.isfile(self.part_file):
+            os.remove(self.part_file)
+        os.rename(cbz_tmp, self.part_file)
+        with open(self.manifest_file, 'w') as f:
+            json.dump({'pages': pages}, f)
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+    def remove(self):
+        """Deletes the saved pages"""
+        self.close()
+        self.pages = {}
+        for name in (self.manifest_file, self.part_file):
+            if os.path.isfile(name):
+                os.remove(name)
+
+
+class SessionPool(object):
+    """requests sessions shared by everything downloading from the same site"""
+    def __init__(self):
+        self._sessions = {}
+        self._sizes = {}
+        self._lock = Lock()
+
+    def get(self, key, size):
+        """Returns the session of key, with room for at least size connections per host"""
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = requests.Session()
+                self._sizes[key] = 0
+            if size > self._sizes[key]:
+                # requests in flight keep the adapter they started with
+                adapter = HTTPAdapter(pool_maxsize=size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sizes[key] = size
+            return session
+
+
+_sessions = SessionPool()
+
+
+class ChapterJob(object):
+    """Pending download of a chapter"""
+    def __init__(self, chapter, cbz_file, entry_prefix=''):
+        self.chapter = chapter
+        self.cbz_file = cbz_file
+        # put before page names in the archive, for chapters of a volume archive
+        self.entry_prefix = entry_prefix
+        # saved pages are kept per chapter, whatever archive it goes into
+        self.checkpoint = Checkpoint(os.path.join(os.path.dirname(cbz_file),
+                                                  chapter.name + os.path.extsep + 'cbz'))
+        self.pages = None
+        # page download tasks, None for pages we have in the checkpoint
+        self.images = []
+        self.cancelled = False
+
+    def cancel(self):
+        """Drops the tasks of this chapter that haven't started yet"""
+        self.cancelled = True
+        if self.pages is not None:
+            self.pages.cancelled = True
+        for task in self.images:
+            if task is not None:
+                task.cancelled = True
+
+    def discard(self, buffer):
+        """Cancels the job and frees the pages it has downloaded already"""
+        self.cancel()
+        self.checkpoint.close()
+        for task in list(self.images):
+            if task is not None and task.peek() is not None and task.peek()[1] is not None:
+                buffer.release(task.peek()[1])
+
+
 class GetManga(object):
     def __init__(self, site, title):
         self.concurrency = 4
         self.path = '.'
-
+        self.show_progress = True
+        # how pages are compressed in the archive: 'auto' stores images that
+        # are already compressed and deflates the rest, 'deflate' or 'store'
+        self.compression = 'auto'
+        # bytes of page images held in memory, the rest goes to temporary files
+        self.memory_limit = 64 * 1024 * 1024
+        # optional DownloadIndex, answers checkExists without touching the disk
+        self.index = None
+        # optional BlobStore, images of urls downloaded before are taken from
+        # it and pages that are known ads are left out
+        self.blobs = None
+        # name of the newest chapter on the site, once new chapters were looked for
+        self.newest = None
+        # add chapters to an archive per volume instead of one per chapter,
+        # chapters without a volume still get their own
+        self.by_volume = False
+        # optional Transcoder, re-encodes and downscales pages before they
+        # are written
+        self.transcoder = None
+
+        self.site = site
         self.title = title
         self.manga = SITES[site](title)
+        # WorkerPool shared by all chapters downloaded by this instance
+        self.pool = None
+        self.buffer = None
+        self._order = count()
+        self._downloaded = None
+        # pool workers allowed to use the network at once
+        self._downloads = None
+        # volume archive -> names of the chapters in it
+        self._volumes = {}
 
     @property
     def chapters(self):
@@ -49,8 +382,20 @@ class GetManga(object):
         """Show last available chapter"""
         return self.manga.chapters[-1]
 
+    def refresh(self):
+        """Forget the cached chapter list, the next access will fetch it again"""
+        self.manga.refresh()
+
     def checkExists(self, chapter):
         """Checks if manga chapter has already been downloaded"""
+        if self.by_volume and chapter.volume is not None:
+            if chapter.name in self._volume_chapters(self._volume_file(chapter)):
+                return True
+        if self.index is not None:
+            if self._downloaded is None:
+                self._downloaded = self.index.downloaded(self.path)
+            return chapter.name in self._downloaded
+
         path = os.path.expanduser(self.path)
         if not os.path.isdir(path):
             try:
@@ -68,28 +413,91 @@ class GetManga(object):
 
     def numNewChapters(self):
         """Returns the number of new chapters available (past those that have been downloaded)"""
-        counter = 0
-        for chapter in self.chapters:
-            counter += 1
-            if self.checkExists(chapter):
-                counter = 0
-        return counter
+        return len(self._new_chapters())
 
     def getNewChapters(self):
         """Downloads all new chapters available (past those that have been downloaded)"""
+        chapters = self._new_chapters()
+        self.getChapters(chapters)
+        if len(chapters) == 0:
+            sys.stdout.write("No new chapters for {0}.\n".format(self.title))
+        else:
+            self._set_watermark(chapters[-1], self.manga.index_fingerprint)
+
+    def _new_chapters(self):
+        """Returns the chapters after the newest one downloaded, oldest first.
+
+        With an index, only the part of the chapter list after the watermark
+        (the newest chapter downloaded so far) is looked at, and not even
+        that if the index page hasn't changed since."""
+        watermark = None
+        if self.index is not None:
+            watermark = self.index.watermark(self.path, self.site, self.title)
+        if watermark is not None:
+            (name, uri, fingerprint) = watermark
+            if self.checkExists(Chapter(None, name, uri, None)):
+                chapters, new_fingerprint = self.manga.new_chapters(uri, fingerprint)
+                if chapters is not None:
+                    self.newest = chapters[-1].name if chapters else name
+                    newi = self._downloaded_until(chapters)
+                    if newi:
+                        self._set_watermark(chapters[newi - 1],
+                                            new_fingerprint if newi == len(chapters) else None)
+                    elif not chapters and new_fingerprint != fingerprint:
+                        self._set_watermark(Chapter(None, name, uri, None), new_fingerprint)
+                    return chapters[newi:]
+            # chapter urls changed or the archive is gone, look at everything
+
+        chapters = self.chapters
+        self.newest = chapters[-1].name
+        newi = self._downloaded_until(chapters)
+        if newi:
+            self._set_watermark(chapters[newi - 1],
+                                self.manga.index_fingerprint if newi == len(chapters) else None)
+        return chapters[newi:]
+
+    def _downloaded_until(self, chapters):
+        """Returns the position after the last downloaded chapter of chapters"""
         newi = 0
-        i = 0
-        for chapter in self.chapters:
+        for i, chapter in enumerate(chapters):
             if self.checkExists(chapter):
-                newi = i+1
-            i += 1
-        for chapter in self.chapters[newi:]:
-            self.get(chapter)
-        if len(self.chapters[newi:]) == 0:
-            sys.stdout.write("No new chapters for {0}.\n".format(self.title))
+                newi = i + 1
+        return newi
+
+    def _set_watermark(self, chapter, fingerprint=None):
+        """Records chapter as the newest one downloaded, fingerprint is that of
+        the index page it is the newest chapter on"""
+        if self.index is not None:
+            self.index.set_watermark(self.path, self.site, self.title,
+                                     chapter.name, chapter.uri, fingerprint)
 
     def get(self, chapter):
         """Downloads manga chapter as cbz archive"""
+        self.getChapters([chapter])
+
+    def getChapters(self, chapters):
+        """Downloads chapters as cbz archives, the next chapter is fetched while
+        the current one is being finished"""
+        jobs = []
+        try:
+            for chapter in chapters:
+                job = self._start(chapter)
+                if job is None:
+                    continue
+                jobs.append(job)
+                if len(jobs) > 1:
+                    self._finish(jobs[0])
+                    jobs.pop(0)
+            while jobs:
+                self._finish(jobs[0])
+                jobs.pop(0)
+        finally:
+            for job in jobs:
+                job.discard(self.buffer)
+
+    def _start(self, chapter):
+        """Queues page list and page downloads of a chapter, returns the job or
+        None if it has been downloaded already"""
         path = os.path.expanduser(self.path)
         if not os.path.isdir(path):
             try:
@@ -102,87 +510,298 @@ class GetManga(object):
 
         if os.path.isfile(cbz_file):
             sys.stdout.write("file {0} exist, skipped download\n".format(cbz_name))
+            self._record(chapter, cbz_file, None)
             return
+        entry_prefix = ''
+        if self.by_volume and chapter.volume is not None:
+            cbz_file = self._volume_file(chapter)
+            if chapter.name in self._volume_chapters(cbz_file):
+                sys.stdout.write("{0} is in {1} already, skipped download\n".format(
+                    chapter.name, os.path.basename(cbz_file)))
+                return
+            entry_prefix = chapter.name + '/'
+
+        if self.pool is None:
+            self.pool = WorkerPool(self.concurrency)
+        # sites that block us when we go too fast get a single connection
+        downloads = 1 if self.manga.threadless else self.concurrency
+        if self._downloads is None:
+            self._downloads = BoundedSemaphore(downloads)
+        self.pool.size = downloads
+        if self.transcoder is not None:
+            # workers waiting for a transcoding process don't download, give
+            # each process a worker to keep it busy
+            self.pool.size += self.transcoder.processes
+        self.manga.connections = max(self.manga.connections, downloads)
+        if self.buffer is None or self.buffer.limit != self.memory_limit:
+            self.buffer = PageBuffer(self.memory_limit, self.pool.size)
+
+        job = ChapterJob(chapter, cbz_file, entry_prefix)
+        order = next(self._order)
+        # page lists jump ahead of queued images, so the next chapter's pages
+        # are queued right behind the ones of the chapter being downloaded.
+        job.pages = self.pool.submit((0, order), self._queue_pages, job, order)
+        return job
+
+    def _queue_pages(self, job, order):
+        """Fetches the page list of a chapter and queues its images"""
+        metrics = self.manga.metrics
+        # the pool has more workers than connections, everything that goes
+        # to the site takes one
+        with self._downloads, metrics.timer('pages', self.site, job.chapter.name):
+            pages = self.manga.get_pages(job.chapter.uri)
+        #pages = [pages[0]]# debug
+        with self._downloads, metrics.timer('image_uri', self.site, job.chapter.name):
+            image_uris = self.manga.get_image_uris(job.chapter.uri, pages)
+        for index, page in enumerate(pages):
+            if page.name in job.checkpoint.pages:
+                # saved by an earlier attempt
+                job.images.append(None)
+                continue
+            job.images.append(self.pool.submit((1, order, index), self._get_image, job, page, image_uris[index]))
+        if job.cancelled:
+            job.cancel()
+        return pages
 
-        cbz_tmp = '{0}.tmp'.format(cbz_file)
+    def _finish(self, job):
+        """Writes the pages of a chapter to its archive as they arrive"""
+        cbz_file = job.cbz_file
+        cbz_name = os.path.basename(cbz_file)
+        # chapters of a volume are written on their own too, and only added
+        # to the volume archive once complete
+        cbz_tmp = '{0}.tmp'.format(os.path.join(os.path.dirname(cbz_file),
+                                                job.chapter.name + os.path.extsep + 'cbz'))
 
         try:
             cbz = ZipFile(cbz_tmp, mode='w', compression=ZIP_DEFLATED)
-        except IOError as msg:
+        except (IOError, OSError) as msg:
+            job.discard(self.buffer)
             raise MangaException(msg)
 
-        sys.stdout.write("downloading {0} {1} to {2}\n".format(self.title, chapter.number,cbz_name))
-
-        pages = self.manga.get_pages(chapter.uri)
-        #pages = [pages[0]]# debug
-        progress(0, len(pages))
-
-        ## debug
-        #print()
-        ##print(chapter.uri)
-        #print(pages[0])
-        #print()
-        #raise MangaException("Debug bail")
-
-        threads = []
-        semaphore = Semaphore(self.concurrency)
-        queue = Queue()
-        for page in pages:
-            thread = Thread(target=self._get_image, args=(semaphore, queue, page))
-            thread.daemon = True
-            if not (self.manga.threadless):
-                thread.start()
-            threads.append(thread)
+        sys.stdout.write("downloading {0} {1} to {2}\n".format(self.title, job.chapter.number, cbz_name))
 
+        metrics = self.manga.metrics
         try:
-            for thread in threads:
-                if (self.manga.threadless):
-                    thread.start()
-                thread.join()
-                name, image = queue.get()
-                if not name:
-                    raise MangaException(image)
-                cbz.writestr(name, image)
-                progress(len(cbz.filelist), len(pages))
-        except Exception as msg:
+            with metrics.timer('write_wait', self.site, job.chapter.name):
+                pages = job.pages.result()
+        except Exception:
+            job.checkpoint.close()
             cbz.close()
             os.remove(cbz_tmp)
+            raise
+        if self.show_progress:
+            progress(0, len(pages))
+
+        # page name -> archive entry of the pages written so far
+        written = {}
+        try:
+            for position, (page, task) in enumerate(zip(pages, job.images)):
+                if task is None:
+                    with metrics.timer('zip_write', self.site, job.chapter.name):
+                        name = job.checkpoint.copy(page.name, cbz)
+                else:
+                    # waiting here means the downloads can't keep up
+                    with metrics.timer('write_wait', self.site, job.chapter.name):
+                        name, image = task.result()
+                    metrics.observe('queue_wait', self.site, task.started - task.queued, job.chapter.name)
+                    if image is None:
+                        # a known ad, left out
+                        continue
+                    try:
+                        with metrics.timer('zip_write', self.site, job.chapter.name):
+                            write_page(cbz, name, image, self._compress_type(image))
+                    finally:
+                        self.buffer.release(image)
+                written[page.name] = name
+                if self.show_progress:
+                    progress(position + 1, len(pages))
+        except Exception as msg:
+            # the chapter is lost anyway, don't waste requests on it
+            job.cancel()
+            metrics.count('failures', self.site, 'chapter')
+            self._save_checkpoint(job, cbz, cbz_tmp, pages, written)
+            job.discard(self.buffer)
             raise MangaException(msg)
         else:
             cbz.close()
-            os.rename(cbz_tmp, cbz_file)
+            if job.entry_prefix and os.path.isfile(cbz_file):
+                try:
+                    append_archive(cbz_file, cbz_tmp, '{0}.tmp'.format(cbz_file))
+                except (IOError, OSError, BadZipfile) as msg:
+                    # the volume is as it was, the chapter is kept whole
+                    job.checkpoint.save(cbz_tmp, written)
+                    raise MangaException('{0}: {1}'.format(cbz_name, msg))
+                os.remove(cbz_tmp)
+            else:
+                if os.name == 'nt' and os.path.isfile(cbz_file):
+                    os.remove(cbz_file)
+                os.rename(cbz_tmp, cbz_file)
+            job.checkpoint.remove()
+            if job.entry_prefix:
+                self._volume_chapters(cbz_file).add(job.chapter.name)
+                self._record(job.chapter, cbz_file, None)
+            else:
+                self._record(job.chapter, cbz_file, len(pages))
 
-    def _get_image(self, semaphore, queue, page):
-        """Downloads page images inside a thread"""
+    def _save_checkpoint(self, job, cbz, cbz_tmp, pages, written):
+        """Keeps every page we have of a failed chapter for the next attempt"""
+        for page, task in zip(pages, job.images):
+            if page.name in written:
+                continue
+            try:
+                if task is None:
+                    written[page.name] = job.checkpoint.copy(page.name, cbz)
+                elif task.peek() is not None and task.peek()[1] is not None:
+                    name, image = task.peek()
+                    write_page(cbz, name, image, self._compress_type(image))
+                    written[page.name] = name
+            except Exception:
+                continue
+        cbz.close()
+        job.checkpoint.save(cbz_tmp, written)
+        if written:
+            sys.stdout.write("kept {0} of {1} pages for the next attempt\n".format(len(written), len(pages)))
+
+    def _compress_type(self, image):
+        """Returns zip compression of a page image, as the compression policy says"""
+        if self.compression == 'store':
+            return ZIP_STORED
+        if self.compression == 'auto' and image_type(image) is not None:
+            return ZIP_STORED
+        return ZIP_DEFLATED
+
+    def reindex(self):
+        """Rebuilds the download index of this title from the archives on disk"""
+        if self.index is None:
+            raise MangaException("No download index to rebuild")
+        self.index.sync(self.path, self.title, self.site)
+        self._downloaded = None
+
+    def _stored_image(self, uri, image):
+        """Copies the image of uri from the blob store into image, returns its
+        sha1, or None if it has to be downloaded"""
+        if self.blobs is None:
+            return None
+        digest = self.blobs.lookup(uri)
+        if digest is not None and not self.blobs.is_ad(digest):
+            try:
+                with self.blobs.open(digest) as blob:
+                    shutil.copyfileobj(blob, image)
+            except (IOError, OSError):
+                image.seek(0)
+                image.truncate()
+                digest = None
+        self.manga.metrics.count('blobs', self.site, 'miss' if digest is None else 'hit')
+        return digest
+
+    def _volume_file(self, chapter):
+        """Returns the volume archive of chapter, e.g. fairy_tail_v01.cbz"""
+        # chapter names end in _c<number>
+        name = chapter.name.rsplit('_c', 1)[0]
+        return os.path.join(os.path.expanduser(self.path), name + os.path.extsep + 'cbz')
+
+    def _volume_chapters(self, volume_file):
+        """Returns names of the chapters in a volume archive"""
+        if volume_file not in self._volumes:
+            chapters = set()
+            if os.path.isfile(volume_file):
+                try:
+                    with ZipFile(volume_file) as cbz:
+                        for entry in cbz.namelist():
+                            if '/' in entry:
+                                chapters.add(entry.split('/', 1)[0])
+                except (IOError, BadZipfile) as msg:
+                    raise MangaException('{0}: {1}'.format(volume_file, msg))
+            self._volumes[volume_file] = chapters
+        return self._volumes[volume_file]
+
+    def _record(self, chapter, cbz_file, pages):
+        """Adds a finished chapter to the download index"""
+        if self.index is None:
+            return
+        number = str(chapter.number)
+        if os.path.splitext(os.path.basename(cbz_file))[0] != chapter.name:
+            # a volume archive, its chapters don't have a row of their own
+            number = None
+        # the title as given, what GetManga needs to download it again
+        self.index.add(cbz_file, self.title, self.site, number, pages)
+        if self._downloaded is not None:
+            self._downloaded.add(chapter.name)
+
+    def _get_image(self, job, page, uri=None):
+        """Downloads page image inside a pool worker, returns (name, image file)"""
+        metrics = self.manga.metrics
+        # uri is a guess from the chapter's other pages, if given
+        guessed = bool(uri)
+        if not uri:
+            uri = self._get_image_uri(job, page)
+        image = self.buffer.spool()
         try:
-            semaphore.acquire()
+            digest = self._stored_image(uri, image)
+            if digest is None:
+                try:
+                    self._download(job, page, uri, image)
+                except MangaException:
+                    if not guessed:
+                        raise
+                    # a page unlike the others, e.g. a png among jpgs or a
+                    # double page, ask its own page where the image is
+                    metrics.count('failures', self.site, 'image_uri')
+                    uri = self._get_image_uri(job, page)
+                    self._download(job, page, uri, image)
+                if self.blobs is not None:
+                    digest = self.blobs.put(uri, image)
+        except Exception:
+            image.close()
+            raise
+
+        # mangahere has token as trailing query on it's image url
+        query = uri.find('?')
+        if query != -1:
+            image_ext = uri[:query].split('.')[-1]
+        else:
+            image_ext = uri.split('.')[-1]
+
+        # if the image extension is weird, just assume it should be jpg
+        if image_ext.lower() not in ['png','jpeg','jpg','tif','tiff','pdf','gif','webp','bmp']:
+            image_ext = 'jpg'
+
+        # reformat all numbers, e.g. 1->001, 10-> 010 so that they'll be sorted properly
+        new_page_name = NUMBER.sub(lambda x: x.group(1).zfill(3), page.name)
+
+        #print("Image URI: " + uri)
+        name = job.entry_prefix + new_page_name + os.path.extsep + image_ext
+        if self.blobs is not None and self.blobs.is_ad(digest):
+            metrics.count('blobs', self.site, 'ad')
+            image.close()
+            return (name, None)
+        if self.transcoder is not None and not job.cancelled:
+            # the blob store keeps the original, so other settings can use it
+            try:
+                with metrics.timer('transcode', self.site, job.chapter.name):
+                    (name, result) = self.transcoder.transcode(name, image)
+            except Exception:
+                image.close()
+                raise
+            metrics.count('transcodes', self.site, result)
+        self.buffer.keep(image)
+        if job.cancelled:
+            self.buffer.release(image)
+            raise MangaException("Download cancelled")
+        return (name, image)
+
+    def _get_image_uri(self, job, page):
+        """Returns image uri of a page from its html"""
+        with self._downloads, self.manga.metrics.timer('image_uri', self.site, job.chapter.name):
             uri = self.manga.get_image_uri(page.uri)
-            if not uri:
-                raise MangaException("Failed to download image")
-            # mangahere has token as trailing query on it's image url
-            query = uri.find('?')
-            if query != -1:
-                image_ext = uri[:query].split('.')[-1]
-            else:
-                image_ext = uri.split('.')[-1]
-
-            # if the image extension is weird, just assume it should be jpg
-            if image_ext.lower() not in ['png','jpeg','jpg','tif','tiff','pdf','gif','webp','bmp']:
-                image_ext = 'jpg'
-
-            # reformat all numbers, e.g. 1->001, 10-> 010 so that they'll be sorted properly
-            numrex = re.compile("([0-9]+)")
-            new_page_name = re.sub(numrex, lambda x: x.group(1).zfill(3), page.name)
+        if not uri:
+            raise MangaException("Failed to download image")
+        return uri
 
-            #print("Image URI: " + uri)
-            name = new_page_name + os.path.extsep + image_ext
-            image = self.manga.download(uri, page.uri)
-        except MangaException as msg:
-            queue.put((None, msg))
-        else:
-            queue.put((name, image))
-        finally:
-            semaphore.release()
+    def _download(self, job, page, uri, image):
+        """Downloads the image of a page into image"""
+        with self._downloads, self.manga.metrics.timer('download', self.site, job.chapter.name):
+            self.manga.download(uri, page.uri, image)
 
 
 class MangaSite(object):
@@ -198,12 +817,45 @@ class MangaSite(object):
     # cases we set threadless to True and download sequentially.
     threadless = False
 
+    # seconds a fetched chapter list stays valid, None keeps it for the
+    # lifetime of the instance (use refresh() to force a new fetch).
+    chapters_ttl = None
+
+    # optional HttpCache for index and page list html
+    http_cache = None
+
+    # RetryPolicy of every request of the site, retries are counted per site
+    retry_policy = RetryPolicy()
+
+    # requests, bytes, retries and stage timings of every site
+    metrics = Metrics()
+
+    # optional RateLimiter every request of the site has to go through,
+    # shared by all instances (and threads) of the site.
+    rate_limiter = None
+
 
     _headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36'} 
 
+    # connections kept open to each host, raised to the download concurrency
+    connections = 10
+
+    # image urls that only differ by page number can be guessed from a few
+    # pages instead of fetching every page's html
+    guess_image_uris = False
+
+    # stop parsing image pages once the image is found, the rest of the
+    # page is still read so the connection can be reused
+    early_exit = True
+
     def __init__(self, title):
         self.input_title = title.strip()
-        self.session = requests.Session()
+
+        self._chapters = None
+        self._chapters_time = 0
+        self._chapters_lock = Lock()
+        # sha1 of the index page last fetched
+        self.index_fingerprint = None
 
     @property
     def title(self):
@@ -224,33 +876,87 @@ class MangaSite(object):
 
     @property
     def chapters(self):
-        """Returns available chapters"""
-        content = self.session.get(self.title_uri, headers=self._headers).text
-        doc = html.fromstring(content)
-        _chapters = doc.cssselect(self._chapters_css)
+        """Returns available chapters, the index page is only fetched once per ttl"""
+        with self._chapters_lock:
+            expired = (self.chapters_ttl is not None and
+                       time() - self._chapters_time > self.chapters_ttl)
+            if self._chapters is None or expired:
+                with self.metrics.timer('index', self.site_name):
+                    self._chapters = self._get_chapters()
+                self._chapters_time = time()
+            return list(self._chapters)
+
+    def refresh(self):
+        """Drops cached chapter list"""
+        with self._chapters_lock:
+            self._chapters = None
+
+    def new_chapters(self, after_uri, fingerprint=None):
+        """Returns (chapters after the one at after_uri, index page fingerprint).
+        Nothing is parsed if the index page still has fingerprint; chapters is
+        None when after_uri isn't on the index page anymore"""
+        content = self._get_index()
+        if self.index_fingerprint == fingerprint:
+            return [], fingerprint
+        with self.metrics.timer('index', self.site_name):
+            chapters = self._parse_chapters(content, after_uri)
+        return chapters, self.index_fingerprint
+
+    def _get_index(self):
+        """Returns html of the index page"""
+        content = self._get_html(self.title_uri, cache=True)
+        self.index_fingerprint = hashlib.sha1(content.encode('utf8')).hexdigest()
+        return content
+
+    def _get_chapters(self):
+        """Returns available chapters from the index page"""
+        return self._parse_chapters(self._get_index())
+
+    def _parse_chapters(self, content, after_uri=None):
+        """Returns chapters listed in index page content, oldest first. With
+        after_uri only those after it, or None if it isn't listed; index pages
+        listing the newest first are then only parsed down to it"""
+        if after_uri is not None and self.descending_list:
+            def is_after(element):
+                location = element.get('href')
+                return bool(location) and self._get_chapter_uri(location) == after_uri
+            _chapters = select_until(content, self._chapters_css, is_after)
+        else:
+            _chapters = select(html.fromstring(content), self._chapters_css)
         if self.descending_list:
             _chapters = reversed(_chapters)
 
         chapters = []
+        found = after_uri is None
         for _chapter in _chapters:
-            number = self._get_chapter_number(_chapter)
             location = _chapter.get('href')
+            uri = self._get_chapter_uri(location)
+            if after_uri is not None and uri == after_uri:
+                # only what comes after it
+                found = True
+                chapters = []
+                continue
+            number = self._get_chapter_number(_chapter)
             volume = self._get_chapter_volume(location)
             name = self._get_chapter_name(str(number), volume, location)
-            uri = self._get_chapter_uri(location)
 
             if (number != None):
                 chapters.append(Chapter(number, name, uri, volume))
 
-        if not chapters:
+        if not found:
+            return None
+        if not chapters and after_uri is None:
             raise MangaException("There is no chapter available.")
         return chapters
 
     def get_pages(self, chapter_uri):
         """Returns a list of available pages of a chapter"""
-        content = self.session.get(chapter_uri, headers=self._headers).text
+        return self._parse_pages(chapter_uri, self._get_html(chapter_uri, cache=True))
+
+    def _parse_pages(self, chapter_uri, content):
+        """Returns pages listed in chapter page content"""
         doc = html.fromstring(content)
-        _pages = doc.cssselect(self._pages_css)
+        _pages = select(doc, self._pages_css)
         pages = []
         page_j = 0
         for _page in _pages:
@@ -276,13 +982,17 @@ class MangaSite(object):
         """Returns uri of image from a chapter page"""
         image_uri_csssel = []
 
-        max_attempts = 3
-        attempt = 0
-        while((len(image_uri_csssel) == 0) and (attempt < max_attempts)):
-            content = self.session.get(page_uri, headers=self._headers).text
-            doc = html.fromstring(content)
-            image_uri_csssel = doc.cssselect(self._image_css)
-            attempt += 1
+        def has_image(resp):
+            # pages sometimes come back without the image, fetch those again
+            if self.early_exit:
+                image_uri_csssel[:] = select_early(resp, self._image_css)
+            else:
+                doc = html.fromstring(resp.text)
+                image_uri_csssel[:] = select(doc, self._image_css)
+            return len(image_uri_csssel) > 0
+
+        resp = self._get(page_uri, validate=has_image, attempts=3, stream=self.early_exit, headers=self._headers)
+        resp.close()
         if (len(image_uri_csssel) == 0):
             return None
         else:
@@ -295,33 +1005,141 @@ class MangaSite(object):
             return "{0}{1}".format(self.site_uri, image_uri)
         return image_uri
 
-    def download(self, image_uri, page_uri):
-        # update the session to list the current page as the referrer
-        self.session.headers.update(self._headers)
-        self.session.headers.update({'referer': page_uri})
-        #print image_uri
-        #print self.session.headers
-        #raise MangaException("Debug exit")
+    def get_image_uris(self, chapter_uri, pages):
+        """Returns image uris of pages, None where get_image_uri has to fetch the page"""
+        image_uris = [None] * len(pages)
+        if not self.guess_image_uris or len(pages) < 3:
+            return image_uris
+        if not all(page.name.isdigit() for page in pages):
+            return image_uris
+        numbers = [int(page.name) for page in pages]
+
+        # learn from the first two pages, the last one checks the guess
+        try:
+            for index in (0, 1, -1):
+                image_uris[index] = self.get_image_uri(pages[index].uri)
+        except MangaException:
+            return image_uris
+        template = image_uri_template(image_uris[0], numbers[0], image_uris[1], numbers[1])
+        if template is None or template(numbers[-1]) != image_uris[-1]:
+            return image_uris
+        for index in range(2, len(pages) - 1):
+            image_uris[index] = template(numbers[index])
+        return image_uris
 
-        content = None
-        retry = 0
-        while retry < 5:
+    @property
+    def session(self):
+        """Returns the requests session shared by every instance of the site"""
+        return _sessions.get(self.site_name, self.connections)
+
+    @property
+    def site_name(self):
+        """Returns the site's name as used in SITES"""
+        return self.__class__.__name__.lower()
+
+    def _get(self, uri, validate=None, attempts=None, kind='html', **kwargs):
+        """Sends a GET request, every request of the site goes through here.
+
+        Connection errors, throttling and server errors, and responses that
+        validate(resp) rejects are retried as retry_policy says. Returns the
+        last response, or raises MangaException if there never was one."""
+        policy = self.retry_policy
+        attempts = attempts or policy.attempts
+        kwargs.setdefault('timeout', policy.timeout)
+
+        start = time()
+        attempt = 0
+        while True:
+            attempt += 1
+            resp = error = None
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait(uri)
+            self.metrics.count('requests', self.site_name, kind)
             try:
-                resp = self.session.get(image_uri, timeout=9.05)
-                if str(resp.status_code).startswith('4'):
-                    retry = 5
-                elif str(resp.status_code).startswith('5'):
-                    retry += 1
-                elif ('content-length' in resp.headers) and (len(resp.content) != int(resp.headers['content-length'])):
-                    retry += 1
+                resp = self.session.get(uri, **kwargs)
+                if resp.status_code not in policy.retry_statuses:
+                    # other errors won't get better by asking again
+                    if resp.status_code >= 400 or validate is None or validate(resp):
+                        self._count_bytes(resp, kind)
+                        if resp.status_code >= 400:
+                            self.metrics.count('failures', self.site_name, resp.status_code)
+                        return resp
+                    reason = 'invalid'
                 else:
-                    retry = 5
-                    content = resp.content
-            except Exception:
-                retry += 1
-        if not content:
+                    reason = resp.status_code
+                self._count_bytes(resp, kind)
+            except requests.RequestException as msg:
+                # including errors while validate() reads a streamed body
+                resp, error = None, msg
+                reason = type(msg).__name__
+
+            if attempt >= attempts:
+                break
+            delay = policy.delay(attempt, resp)
+            if time() - start + delay > policy.budget:
+                break
+            policy.count(self.site_name)
+            self.metrics.count('retries', self.site_name, reason)
+            sleep(delay)
+
+        self.metrics.count('failures', self.site_name, reason)
+        if resp is None:
+            raise MangaException("Failed to retrieve {0}: {1}".format(uri, error))
+        return resp
+
+    def _count_bytes(self, resp, kind):
+        """Counts the bytes of resp read from the network so far"""
+        tell = getattr(resp.raw, 'tell', None)
+        if tell is not None:
+            self.metrics.count('bytes', self.site_name, kind, tell())
+
+    def _get_html(self, uri, cache=False):
+        """Returns html content of uri, revalidating a cached copy when allowed"""
+        if not (cache and self.http_cache):
+            return self._get(uri, headers=self._headers).text
+
+        headers = dict(self._headers)
+        entry = self.http_cache.get(uri)
+        if entry:
+            headers.update(self.http_cache.validators(entry))
+        resp = self._get(uri, headers=headers)
+        if entry and resp.status_code == 304:
+            return entry['text']
+        self.http_cache.put(uri, resp)
+        return resp.text
+
+    def download(self, image_uri, page_uri, fileobj=None):
+        """Returns content of an image, or streams it into fileobj if given"""
+        #print image_uri
+        #raise MangaException("Debug exit")
+
+        if fileobj is None:
+            fileobj = BytesIO()
+            self.download(image_uri, page_uri, fileobj)
+            return fileobj.getvalue()
+
+        completed = []
+
+        def complete(resp):
+            # read the image in chunks, truncated images are retried
+            fileobj.seek(0)
+            fileobj.truncate()
+            size = 0
+            for chunk in resp.iter_content(64 * 1024):
+                fileobj.write(chunk)
+                size += len(chunk)
+            length = resp.headers.get('content-length')
+            completed[:] = [size > 0 and (length is None or size == int(length))]
+            return completed[0]
+
+        # the current page is the referrer, the session is shared so the
+        # header goes with this request only.
+        headers = dict(self._headers, referer=page_uri)
+        resp = self._get(image_uri, validate=complete, kind='image', stream=True, timeout=9.05, headers=headers)
+        resp.close()
+        if resp.status_code >= 400 or not completed[0]:
             raise MangaException("Failed to retrieve {0}".format(image_uri))
-        return content
+        return fileobj
 
     @staticmethod
     def _get_chapter_number(chapter):
@@ -335,8 +1153,7 @@ class MangaSite(object):
         # the most common one is getting a section like /v[0-9.]+/c[0-9]*
         # used by: mangafox, mangahere, mangastream
         volume = None
-        vrex = re.compile("/(v[0-9.]+)/c[0-9]")
-        vsearch = vrex.search(location)
+        vsearch = VOLUME.search(location)
         if vsearch:
             volume = vsearch.group(1)
         return volume
@@ -405,6 +1222,17 @@ class MangaDex(MangaSite):
     _pages_css = "select[id|=jump_page] option[value]"
     _image_css = "div[id|=content] img[id|=current_page]"
 
+    # the reader script lists every image of the chapter
+    _server_regex = re.compile(r"var\s+server\s*=\s*'([^']*)'")
+    _dataurl_regex = re.compile(r"var\s+dataurl\s*=\s*'([^']*)'")
+    _page_array_regex = re.compile(r"var\s+page_array\s*=\s*\[([^\]]*)\]")
+
+    def __init__(self, title):
+        MangaSite.__init__(self, title)
+        # chapter uri -> html get_pages fetched, until get_image_uris reads it
+        self._chapter_html = {}
+        self._chapter_lock = Lock()
+
     @property
     def title_uri(self):
         """Returns the index page's url of manga title"""
@@ -422,8 +1250,7 @@ class MangaDex(MangaSite):
     def _get_chapter_number(chapter):
         """Returns chapter's number from a chapter's HtmlElement"""
         # idea: match the last number in the string
-        last_num_regex = re.compile('\\b([0-9][0-9.]*)\\b[^0-9]*$')
-        last_num_search = last_num_regex.search(chapter.text.strip())
+        last_num_search = LAST_DECIMAL.search(chapter.text.strip())
         if (last_num_search):
             return last_num_search.group(1)
         else:
@@ -432,13 +1259,42 @@ class MangaDex(MangaSite):
     @staticmethod
     def _get_page_name(page_text, page_j):
         """Returns page name from text available or None if it's not a valid page"""
-        last_num_regex = re.compile('\\b([0-9]+)\\b[^0-9]*$')
-        last_num_search = last_num_regex.search(page_text.strip())
+        last_num_search = LAST_NUMBER.search(page_text.strip())
         if (last_num_search):
             return last_num_search.group(1)
         else:
             return None
 
+    def get_pages(self, chapter_uri):
+        """Returns a list of available pages of a chapter, its html is kept
+        for get_image_uris"""
+        content = self._get_html(chapter_uri, cache=True)
+        with self._chapter_lock:
+            self._chapter_html[chapter_uri] = content
+        return self._parse_pages(chapter_uri, content)
+
+    def get_image_uris(self, chapter_uri, pages):
+        """Returns image uris of pages from the chapter's reader script"""
+        image_uris = [None] * len(pages)
+        with self._chapter_lock:
+            content = self._chapter_html.pop(chapter_uri, None)
+        if content is None:
+            content = self._get_html(chapter_uri, cache=True)
+        server = self._server_regex.search(content)
+        dataurl = self._dataurl_regex.search(content)
+        page_array = self._page_array_regex.search(content)
+        if not (server and dataurl and page_array):
+            return image_uris
+
+        server = server.group(1)
+        if server.startswith('/'):
+            server = "{0}{1}".format(self.site_uri, server)
+        files = re.findall(r"'([^']+)'", page_array.group(1))
+        for index, page in enumerate(pages):
+            if page.name.isdigit() and 0 < int(page.name) <= len(files):
+                image_uris[index] = "{0}{1}/{2}".format(server, dataurl.group(1), files[int(page.name) - 1])
+        return image_uris
+
     @staticmethod
     def _get_page_uri(chapter_uri, page_name, page):
         """Returns manga image page url"""
@@ -519,8 +1375,7 @@ class CartoonMad(MangaSite):
     def _get_chapter_number(chapter):
         """Returns chapter's number from a chapter's HtmlElement"""
         # idea: match the last number in the string
-        last_num_regex = re.compile('\\b([0-9]+)\\b[^0-9]*$')
-        last_num_search = last_num_regex.search(chapter.text.strip())
+        last_num_search = LAST_NUMBER.search(chapter.text.strip())
         if (last_num_search):
             return last_num_search.group(1)
         else:
@@ -529,8 +1384,7 @@ class CartoonMad(MangaSite):
     @staticmethod
     def _get_page_name(page_text, page_j):
         """Returns page name from text available or None if it's not a valid page"""
-        last_num_regex = re.compile('\\b([0-9]+)\\b[^0-9]*$')
-        last_num_search = last_num_regex.search(page_text.strip())
+        last_num_search = LAST_NUMBER.search(page_text.strip())
         if (last_num_search):
             return last_num_search.group(1)
         else:
@@ -540,8 +1394,9 @@ class CartoonMad(MangaSite):
     def _get_page_uri(chapter_uri, page_name, page):
         """Returns manga image page url"""
         # chapter's page already has the first page's name in it.
+        # pages sit next to the chapter's page
         relative_page_uri = page.get('value')
-        return "http://www.cartoonmad.com/comic/{0}".format(relative_page_uri)
+        return "{0}/{1}".format(chapter_uri.rsplit('/', 1)[0], relative_page_uri)
 
 
 class RawMangaUpdate(MangaSite):
@@ -565,8 +1420,7 @@ class RawMangaUpdate(MangaSite):
         """Returns chapter's number from a chapter's HtmlElement"""
 
         # idea: match the last number in the string
-        last_num_regex = re.compile('\\b([0-9]+)\\b[^0-9]*$')
-        last_num_search = last_num_regex.search(chapter.text.strip())
+        last_num_search = LAST_NUMBER.search(chapter.text.strip())
         if (last_num_search):
             return last_num_search.group(1)
         else:
@@ -605,22 +1459,18 @@ class Webtoons(MangaSite):
         lhs_title = (":".join(self.input_title.split(":")[0:-2])).strip()
         return re.sub(r'[^a-z0-9]+', '-', lhs_title)
 
-    @property
-    def chapters(self):
-        """Returns available chapters"""
-        content = self.session.get(self.title_uri, headers=self._headers).text
+    def _parse_chapters(self, content, after_uri=None):
+        """Returns chapters listed in index page content, oldest first"""
         doc = html.fromstring(content)
-        _lastchapter = doc.cssselect(self._chapters_css)
+        _lastchapter = select(doc, self._chapters_css)
         _lastchapter = _lastchapter[0]
 
         _lastnumber = int(self._get_chapter_number(_lastchapter))
         _lastlocation = _lastchapter.get('href')
 
-        epno_regex = re.compile('episode_no=([0-9]+)')
-
         chapters = []
         for number in range(1,_lastnumber+1):
-            location = re.sub(epno_regex, "episode_no=" + str(number), _lastlocation)
+            location = EPISODE_NO.sub("episode_no=" + str(number), _lastlocation)
             volume = None
             name = self._get_chapter_name(str(number), volume, location)
             uri = self._get_chapter_uri(location)
@@ -628,6 +1478,11 @@ class Webtoons(MangaSite):
             if (number != None):
                 chapters.append(Chapter(number, name, uri, volume))
 
+        if after_uri is not None:
+            uris = [chapter.uri for chapter in chapters]
+            if after_uri not in uris:
+                return None
+            return chapters[uris.index(after_uri) + 1:]
         if not chapters:
             raise MangaException("There is no chapter available.")
         return chapters
@@ -636,14 +1491,12 @@ class Webtoons(MangaSite):
     def _get_chapter_number(chapter):
         """Returns chapter's number from a chapter's HtmlElement"""
 
-        href_regex = re.compile('episode_no=([0-9]+)')
-        href_search = href_regex.search(html.tostring(chapter))
+        href_search = EPISODE_NO.search(html.tostring(chapter, encoding='unicode'))
         if (href_search):
                 return href_search.group(1)
         else: 
             # if that fails, match the last number in the string 
-            last_num_regex = re.compile('\\b([0-9]+)\\b[^0-9]*$')
-            last_num_search = last_num_regex.search(chapter.text.strip())
+            last_num_search = LAST_NUMBER.search(chapter.text.strip())
             if (last_num_search):
                 return last_num_search.group(1)
             else:
@@ -676,6 +1529,7 @@ class SenManga(MangaSite):
     _chapters_css = "div #content div[class|=element] a"
     _pages_css = "div select[name|=page] option"
     _image_css = "img[id|=picture]"
+    guess_image_uris = True
 
     @property
     def title_uri(self):
@@ -711,14 +1565,12 @@ class SenManga(MangaSite):
     def _get_chapter_number(chapter):
         """Returns chapter's number from a chapter's HtmlElement"""
 
-        href_regex = re.compile('a href="[^"]*/([0-9]+)/1?"')
-        href_search = href_regex.search(html.tostring(chapter))
+        href_search = SENMANGA_HREF.search(html.tostring(chapter, encoding='unicode'))
         if (href_search):
                 return href_search.group(1)
         else: 
             # if that fails, match the last number in the string 
-            last_num_regex = re.compile('\\b([0-9]+)\\b[^0-9]*$')
-            last_num_search = last_num_regex.search(chapter.text.strip())
+            last_num_search = LAST_NUMBER.search(chapter.text.strip())
             if (last_num_search):
                 return last_num_search.group(1)
             else:
@@ -744,12 +1596,13 @@ class MangaStream(MangaSite):
     _chapters_css = "td a"
     _pages_css = "div.btn-group ul.dropdown-menu li a"
     _image_css = "img#manga-page"
+    guess_image_uris = True
 
     def get_pages(self, chapter_uri):
         """Returns a list of available pages of a chapter"""
-        content = self.session.get(chapter_uri, headers=self._headers).text
+        content = self._get_html(chapter_uri, cache=True)
         doc = html.fromstring(content)
-        _pages = doc.cssselect(self._pages_css)
+        _pages = select(doc, self._pages_css)
         for _page in _pages:
             page_text = _page.text
             if not page_text:
@@ -783,6 +1636,7 @@ class MangaReader(MangaSite):
     _chapters_css = "#chapterlist td a"
     _pages_css = "div#selectpage option"
     _image_css = "img#img"
+    guess_image_uris = True
 
     @property
     def title(self):
@@ -796,7 +1650,7 @@ class MangaReader(MangaSite):
         # some title's page is in the root, others hidden in a random numeric subdirectory,
         # so we need to search the manga list to get the correct url.
         try:
-            content = self.session.get("{0}/alphabetical".format(self.site_uri), headers=self._headers).text
+            content = self._get_html("{0}/alphabetical".format(self.site_uri), cache=True)
             page = re.findall(r'[0-9]+/' + self.title + '.html', content)[0]
             uri = "{0}/{1}".format(self.site_uri, page)
         except IndexError:
@@ -826,6 +1680,181 @@ SITES = dict(mangafox=MangaFox,
              webtoons=Webtoons)
 
 
+def image_type(image):
+    """Returns type of an already compressed image file, None for anything else"""
+    header = image.read(12)
+    image.seek(0)
+    for name, signatures in COMPRESSED_IMAGES:
+        for signature in signatures:
+            if header.startswith(signature):
+                if name == 'webp' and header[8:12] != b'WEBP':
+                    continue
+                return name
+    return None
+
+
+# css selectors translated to xpath once, shared by all site classes
+_selectors = {}
+
+def selector(css):
+    """Returns the compiled CSSSelector of css"""
+    compiled = _selectors.get(css)
+    if compiled is None:
+        compiled = _selectors[css] = CSSSelector(css)
+    return compiled
+
+def select(doc, css):
+    """Returns elements of doc matching css"""
+    return selector(css)(doc)
+
+def select_early(resp, css, chunk_size=16384):
+    """Returns elements matching css from the html of a streamed response,
+    parsing only until the first match"""
+    compiled = selector(css)
+    tag = TARGET_TAG.search(css)
+    if tag is None:
+        return select(html.fromstring(resp.content), css)
+    parser = etree.HTMLPullParser(events=('start',), tag=tag.group(1).lower())
+    found = []
+    for chunk in resp.iter_content(chunk_size):
+        if found:
+            continue
+        parser.feed(chunk)
+        for _, element in parser.read_events():
+            # attributes and ancestors of an element are there on start
+            found = compiled(element.getroottree())
+            if found:
+                break
+    if not found:
+        try:
+            found = compiled(parser.close())
+        except etree.LxmlError:
+            # nothing that looks like html
+            return []
+    return found
+
+def select_until(content, css, stop, chunk_size=16384):
+    """Returns elements matching css from html content, parsing only until a
+    matching element for which stop(element) is true, the last one returned"""
+    compiled = selector(css)
+    tag = TARGET_TAG.search(css)
+    if tag is None:
+        return select(html.fromstring(content), css)
+    parser = etree.HTMLPullParser(events=('end',), tag=tag.group(1).lower())
+    try:
+        for start in range(0, len(content), chunk_size):
+            parser.feed(content[start:start + chunk_size])
+            for _, element in parser.read_events():
+                if not stop(element):
+                    continue
+                # the parser is past it, later matches may be in the tree too
+                found = compiled(element.getroottree())
+                if element in found:
+                    return found[:found.index(element) + 1]
+        return compiled(parser.close())
+    except (etree.LxmlError, ValueError):
+        # nothing that looks like html, or a document the pull parser won't take
+        return select(html.fromstring(content), css)
+
+def image_uri_template(first_uri, first, second_uri, second):
+    """Returns a function making image uris from page numbers, or None if the
+    uris of pages first and second differ by more than their page numbers"""
+    if not (first_uri and second_uri):
+        return None
+    # numbers end up at the odd indexes
+    first_parts = NUMBER.split(first_uri)
+    second_parts = NUMBER.split(second_uri)
+    if len(first_parts) != len(second_parts):
+        return None
+    changed = [i for i, part in enumerate(first_parts) if part != second_parts[i]]
+    if len(changed) != 1 or changed[0] % 2 == 0:
+        return None
+    i = changed[0]
+    offset = int(first_parts[i]) - first
+    if int(second_parts[i]) - second != offset:
+        return None
+    # keep zero padding, e.g. 001.jpg
+    width = len(first_parts[i]) if first_parts[i].startswith('0') else 1
+
+    def image_uri(number):
+        parts = list(first_parts)
+        parts[i] = str(number + offset).zfill(width)
+        return ''.join(parts)
+    return image_uri
+
+def write_page(cbz, name, image, compress_type=ZIP_DEFLATED):
+    """Writes a page image file to the archive"""
+    # same entry as writestr would make, with our own compression
+    zinfo = ZipInfo(name, date_time=localtime(time())[:6])
+    zinfo.external_attr = 0o600 << 16
+    zinfo.compress_type = compress_type
+    if sys.version_info >= (3, 6, 0):
+        # stream it
+        with cbz.open(zinfo, mode='w') as entry:
+            shutil.copyfileobj(image, entry, 64 * 1024)
+    else:
+        cbz.writestr(zinfo, image.read())
+
+
+def append_archive(cbz_file, part_file, cbz_tmp):
+    """Adds the entries of archive part_file to archive cbz_file. They go
+    into cbz_tmp, a copy of it, which then replaces it; entries are copied
+    as they are, never decompressed or compressed again"""
+    shutil.copyfile(cbz_file, cbz_tmp)
+    try:
+        with ZipFile(part_file) as part:
+            cbz = ZipFile(cbz_tmp, mode='a')
+            try:
+                # the new entries go over the central directory, close()
+                # writes it again after them
+                position = cbz.start_dir
+                with open(part_file, 'rb') as f:
+                    for zinfo in sorted(part.infolist(), key=lambda zinfo: zinfo.header_offset):
+                        data = _read_entry(f, zinfo)
+                        cbz.fp.seek(position)
+                        cbz.fp.write(data)
+                        entry = ZipInfo(zinfo.filename, zinfo.date_time)
+                        for field in ZIPINFO_FIELDS:
+                            setattr(entry, field, getattr(zinfo, field))
+                        entry.header_offset = position
+                        cbz.filelist.append(entry)
+                        cbz.NameToInfo[entry.filename] = entry
+                        position += len(data)
+                cbz.start_dir = position
+                cbz.fp.seek(position)
+                cbz._didModify = True
+            finally:
+                cbz.close()
+    except Exception:
+        os.remove(cbz_tmp)
+        raise
+    if os.name == 'nt':
+        os.remove(cbz_file)
+    os.rename(cbz_tmp, cbz_file)
+
+
+def _read_entry(f, zinfo):
+    """Returns the bytes of an archive entry as stored: local header,
+    compressed data and data descriptor"""
+    f.seek(zinfo.header_offset)
+    header = f.read(30)
+    if len(header) != 30 or header[:4] != b'PK\x03\x04':
+        raise BadZipfile("Bad local header of {0}".format(zinfo.filename))
+    (name_length, extra_length) = struct.unpack('<HH', header[26:30])
+    size = name_length + extra_length + zinfo.compress_size
+    if zinfo.flag_bits & 0x08:
+        # sizes in a descriptor after the data, with or without signature
+        f.seek(zinfo.header_offset + 30 + size)
+        signature = f.read(4) == b'PK\x07\x08'
+        zip64 = zinfo.compress_size > ZIP64_LIMIT or zinfo.file_size > ZIP64_LIMIT
+        size += (4 if signature else 0) + (20 if zip64 else 12)
+        f.seek(zinfo.header_offset + 30)
+    data = header + f.read(size)
+    if len(data) != 30 + size:
+        raise BadZipfile("Truncated entry {0}".format(zinfo.filename))
+    return data
+
+
 def progress(page, total):
     """Display progress bar"""
     try:
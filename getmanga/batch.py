@@ -0,0 +1,84 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import sys
+from collections import deque
+from threading import Condition, Thread
+
+from getmanga import SITES
+
+
+class Batch(object):
+    """Runs queued titles concurrently, taking turns between sites"""
+    def __init__(self, jobs=1, site_jobs=2):
+        self.jobs = jobs
+        self.site_jobs = site_jobs
+
+        self._queues = {}
+        self._sites = deque()
+        self._running = {}
+        self._cond = Condition()
+
+    def add(self, site, name, func, *args):
+        """Queues func(*args) as the download of title name from site"""
+        with self._cond:
+            if site not in self._queues:
+                self._queues[site] = deque()
+                self._sites.append(site)
+                self._running[site] = 0
+            self._queues[site].append((name, func, args))
+
+    def site_limit(self, site):
+        """Returns how many titles of site may run at once"""
+        # sites that block fast connections only get one title at a time
+        if site in SITES and SITES[site].threadless:
+            return 1
+        return self.site_jobs
+
+    def run(self):
+        """Runs all queued titles, returns when they are done"""
+        threads = []
+        for _ in range(max(self.jobs, 1)):
+            thread = Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+    def _next(self):
+        """Returns the next (site, name, func, args) to run, or None when done"""
+        with self._cond:
+            while True:
+                pending = False
+                for _ in range(len(self._sites)):
+                    site = self._sites[0]
+                    # whoever gets a turn goes to the back of the line
+                    self._sites.rotate(-1)
+                    if not self._queues[site]:
+                        continue
+                    pending = True
+                    if self._running[site] < self.site_limit(site):
+                        self._running[site] += 1
+                        name, func, args = self._queues[site].popleft()
+                        return site, name, func, args
+                if not pending:
+                    return None
+                self._cond.wait()
+
+    def _work(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            site, name, func, args = job
+            try:
+                func(*args)
+            except Exception as msg:
+                sys.stdout.write('{0}: {1}\n'.format(name, msg))
+            finally:
+                with self._cond:
+                    self._running[site] -= 1
+                    self._cond.notify_all()
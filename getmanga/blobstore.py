@@ -0,0 +1,187 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import hashlib
+import os
+import tempfile
+from threading import Lock
+
+
+class BlobStore(object):
+    """Page images stored once by their sha1, with an index of the urls they came from"""
+    def __init__(self, path, ad_hashes=None, max_size=None):
+        self.path = os.path.expanduser(path)
+        # sha1 of images that are ads, credits or other pages nobody wants
+        self.ad_hashes = set(ad_hashes or ())
+        # bytes of images kept, least recently used go first. None for no limit
+        self.max_size = max_size
+        self._size = None
+        self._lock = Lock()
+
+        self._blob_dir = os.path.join(self.path, 'blobs')
+        self._url_dir = os.path.join(self.path, 'urls')
+        for directory in (self._blob_dir, self._url_dir):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+    @staticmethod
+    def load_hashes(filepath):
+        """Returns the sha1 hashes listed in a file, one per line as sha1sum
+        prints them, # starts a comment"""
+        hashes = set()
+        with open(os.path.expanduser(filepath)) as f:
+            for line in f:
+                fields = line.split('#', 1)[0].split()
+                if fields:
+                    hashes.add(fields[0].lower())
+        return hashes
+
+    def is_ad(self, digest):
+        """Returns True if the image with sha1 digest is a known ad"""
+        return digest in self.ad_hashes
+
+    def lookup(self, uri):
+        """Returns the sha1 of the image stored for uri, or None"""
+        try:
+            with open(self._url_file(uri), 'rb') as f:
+                digest, stored_uri = f.read().decode('utf8').split('\n', 1)
+        except (IOError, OSError, ValueError):
+            return None
+        if stored_uri != uri:
+            return None
+        try:
+            # mtime is used as the last access time for eviction
+            os.utime(self._blob_file(digest), None)
+        except OSError:
+            # evicted, forget the url too
+            _remove(self._url_file(uri))
+            return None
+        return digest
+
+    def open(self, digest):
+        """Returns the stored image with sha1 digest as an open file"""
+        return open(self._blob_file(digest), 'rb')
+
+    def put(self, uri, image):
+        """Stores an image file downloaded from uri, returns its sha1.
+
+        The file position is left where it was. Failing to store the image
+        is not an error, the hash is returned anyway."""
+        position = image.tell()
+        image.seek(0)
+        sha1 = hashlib.sha1()
+        tmp_file = None
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=self._blob_dir, suffix='.tmp')
+            blob = os.fdopen(fd, 'wb')
+        except (IOError, OSError):
+            blob = None
+        try:
+            while True:
+                chunk = image.read(64 * 1024)
+                if not chunk:
+                    break
+                sha1.update(chunk)
+                if blob is not None:
+                    try:
+                        blob.write(chunk)
+                    except (IOError, OSError):
+                        blob.close()
+                        blob = None
+        finally:
+            image.seek(position)
+            if blob is not None:
+                blob.close()
+
+        digest = sha1.hexdigest()
+        if blob is None:
+            _remove(tmp_file)
+            return digest
+        blob_file = self._blob_file(digest)
+        try:
+            if os.path.isfile(blob_file):
+                # same image from another url
+                _remove(tmp_file)
+            else:
+                if not os.path.isdir(os.path.dirname(blob_file)):
+                    os.makedirs(os.path.dirname(blob_file))
+                os.rename(tmp_file, blob_file)
+                self._grow(os.path.getsize(blob_file))
+            self._write_url(uri, digest)
+        except (IOError, OSError):
+            _remove(tmp_file)
+        return digest
+
+    def _grow(self, size):
+        """Counts a new image, evicting old ones if the store got too big"""
+        if self.max_size is None:
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._blobs())
+            else:
+                self._size += size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _blobs(self):
+        """Yields (file, size, mtime) of every stored image"""
+        for prefix in os.listdir(self._blob_dir):
+            prefix_dir = os.path.join(self._blob_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                blob_file = os.path.join(prefix_dir, name)
+                try:
+                    stat = os.stat(blob_file)
+                except OSError:
+                    continue
+                yield blob_file, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        """Removes least recently used images until well under the size cap"""
+        # shrink to 90% so a full store doesn't evict on every new image,
+        # urls of evicted images are dropped when they are looked up
+        target = self.max_size * 0.9
+        for blob_file, size, _ in sorted(self._blobs(), key=lambda b: b[2]):
+            if self._size <= target:
+                break
+            try:
+                os.remove(blob_file)
+            except OSError:
+                continue
+            self._size -= size
+
+    def _write_url(self, uri, digest):
+        """Records that uri gave the image with sha1 digest"""
+        fd, tmp_file = tempfile.mkstemp(dir=self._url_dir, suffix='.tmp')
+        try:
+            os.write(fd, u'{0}\n{1}'.format(digest, uri).encode('utf8'))
+            os.close(fd)
+            url_file = self._url_file(uri)
+            if os.name == 'nt' and os.path.isfile(url_file):
+                os.remove(url_file)
+            os.rename(tmp_file, url_file)
+        except (IOError, OSError):
+            _remove(tmp_file)
+            raise
+
+    def _blob_file(self, digest):
+        """Returns file name of the image with sha1 digest"""
+        return os.path.join(self._blob_dir, digest[:2], digest)
+
+    def _url_file(self, uri):
+        """Returns file name of the index entry of uri"""
+        return os.path.join(self._url_dir, hashlib.sha1(uri.encode('utf8')).hexdigest())
+
+
+def _remove(filepath):
+    """Removes a file if it's there"""
+    if filepath is None:
+        return
+    try:
+        os.remove(filepath)
+    except OSError:
+        pass
@@ -0,0 +1,113 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+from bisect import bisect_left, bisect_right
+
+
+class ChapterCatalog(object):
+    """Chapters of a title indexed by number and volume, built once so any
+    selection is a lookup instead of a pass over the chapter list"""
+    def __init__(self, chapters):
+        self.chapters = list(chapters)
+
+        # chapters whose number isn't a number, e.g. "extra"
+        self._names = {}
+        self._volumes = {}
+
+        keys = []
+        for position, chapter in enumerate(self.chapters):
+            whole = _whole(chapter.number)
+            if whole is None:
+                self._names.setdefault(str(chapter.number), []).append(position)
+            else:
+                keys.append((whole, position))
+            if chapter.volume is not None:
+                self._volumes.setdefault(chapter.volume, []).append(position)
+        keys.sort()
+        # whole chapter numbers in order, 12.1 and 12.2 are parts of 12, and
+        # the list position of the chapter at the same index
+        self._wholes = [whole for whole, _ in keys]
+        self._positions = [position for _, position in keys]
+
+    def parts(self, number):
+        """Returns chapter number and its decimal parts (12, 12.1, 12.5...)"""
+        return self._take(self._between(number, number))
+
+    def between(self, first, last=None):
+        """Returns chapters from first to last, their parts included; without
+        last until the end"""
+        return self._take(self._between(first, last))
+
+    def volumes(self, volumes):
+        """Returns the chapters of volumes, e.g. ['v01', 'v02']"""
+        positions = set()
+        for volume in volumes:
+            positions.update(self._volumes.get(volume, ()))
+        return self._take(positions)
+
+    def select(self, ranges):
+        """Returns (chapters, ranges nothing was found for) of ranges from
+        parse_selector, in the order the site lists them"""
+        positions = set()
+        missing = []
+        for (first, last) in ranges:
+            if _whole(first) is None:
+                # not a number, only the chapter with that name
+                found = self._names.get(first, ())
+            elif not self._has(first) or (last is not None and not self._has(last)):
+                found = ()
+            else:
+                found = self._between(first, last)
+            if found:
+                positions.update(found)
+            else:
+                missing.append((first, last))
+        return self._take(positions), missing
+
+    def _has(self, number):
+        """Returns True if there is a chapter number (or a part of it)"""
+        whole = _whole(number)
+        i = bisect_left(self._wholes, whole)
+        return i < len(self._wholes) and self._wholes[i] == whole
+
+    def _between(self, first, last):
+        """Returns list positions of chapters from first to last"""
+        start = bisect_left(self._wholes, _whole(first))
+        if last is None:
+            return self._positions[start:]
+        return self._positions[start:bisect_right(self._wholes, _whole(last))]
+
+    def _take(self, positions):
+        return [self.chapters[position] for position in sorted(positions)]
+
+
+def parse_selector(selector):
+    """Returns (first, last) ranges of a chapter selector like "1-10,15,20-",
+    last is None for a range without an end. Raises ValueError if it's not one"""
+    ranges = []
+    for part in selector.split(','):
+        part = part.strip()
+        first, dash, last = part.partition('-')
+        first = first.strip()
+        last = last.strip()
+        if not first:
+            raise ValueError("invalid chapter selector: {0}".format(part))
+        if not dash:
+            ranges.append((first, first))
+            continue
+        if _whole(first) is None or (last and _whole(last) is None):
+            raise ValueError("invalid chapter range: {0}".format(part))
+        if last and _whole(first) > _whole(last):
+            raise ValueError("invalid chapter range, the end should be bigger than start: {0}".format(part))
+        ranges.append((first, last or None))
+    return ranges
+
+
+def _whole(number):
+    """Returns the whole chapter number of a chapter number, None if it isn't one"""
+    try:
+        return int(float(number))
+    except (TypeError, ValueError):
+        return None
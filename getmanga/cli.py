@@ -5,6 +5,7 @@
 
 import os
 import sys
+from time import sleep
 try:
     import configparser
 except ImportError:
@@ -17,11 +18,27 @@ try:
 except ImportError:
     sys.exit('You need to have "argparse" module installed to run this script')
 
-from getmanga import SITES, MangaException, GetManga
+from getmanga import SITES, MangaException, MangaSite, GetManga
+from getmanga.batch import Batch
+from getmanga.blobstore import BlobStore
+from getmanga.catalog import ChapterCatalog, parse_selector
+from getmanga.httpcache import HttpCache
+from getmanga.library import DownloadIndex
+from getmanga.profiling import Profiler
+from getmanga.ratelimit import RateLimiter
+from getmanga.verify import verify
+from getmanga.watch import Schedule
 
 
 version = pkg_resources.require("GetManga")[0].version
 
+# seconds between looks at the config file while watching
+WATCH_RELOAD = 30
+# size limit of the html cache in MB, unless told otherwise
+CACHE_SIZE = 64
+# size limit of the blob store in MB, unless told otherwise
+BLOB_SIZE = 1024
+
 
 def cmdparse():
     """Returns parsed arguments from command line"""
@@ -30,42 +47,92 @@ def cmdparse():
     group1 = parser.add_mutually_exclusive_group()
     group1.add_argument('-f', '--file', type=str, help="%(prog)s config file")
     group1.add_argument('-t', '--title', type=str, help="manga title to download")
+    group1.add_argument('--verify', type=str, metavar='DIR',
+                        help="check every archive under DIR for broken pages and archives")
 
     parser.add_argument('-s', '--site', choices=SITES.keys(), default='mangahere',
                         help="manga site to download from")
 
     group = parser.add_mutually_exclusive_group()
     group.add_argument('-a', '--all', action='store_true', help="download all chapters available")
-    group.add_argument('-c', '--chapter', type=str, help="chapter(s) number to download")
+    group.add_argument('-c', '--chapter', type=str,
+                       help="chapter(s) number to download, e.g. 12, 1-10, 20- or 1-10,15,20-")
     group.add_argument('-n', '--new', action='store_true', help="download new chapters")
     group.add_argument('-l', '--latest', action='store_true', help="download latest chapter")
     group.add_argument('--checknew', action='store_true', help="check how many new chapters are available")
     group.add_argument('--list', action='store_true', help="list all available chapters")
+    group.add_argument('--reindex', action='store_true', help="rebuild download index from the archives on disk")
 
+    parser.add_argument('--repair', action='store_true',
+                        help="with --verify, move broken archives aside and download them again")
     parser.add_argument('-d', '--dir', type=str, default='.', help='download directory')
+    parser.add_argument('--cache-dir', type=str, help="cache index and page list html in this directory")
+    parser.add_argument('--cache-size', type=int, help="size limit of html cache in MB (default 64)")
+    parser.add_argument('--index', type=str, help="keep track of downloaded chapters in this file")
+    parser.add_argument('--blob-dir', type=str,
+                        help="keep downloaded page images in this directory, pages are only downloaded once")
+    parser.add_argument('--blob-size', type=int, metavar='MB',
+                        help="size limit of --blob-dir, least recently used images go first (default 1024, 0 for none)")
+    parser.add_argument('--ad-hashes', type=str, metavar='FILE',
+                        help="leave out pages whose sha1 is listed in this file (needs --blob-dir)")
+    parser.add_argument('--by-volume', action='store_true',
+                        help="add chapters to one archive per volume instead of one per chapter")
+    parser.add_argument('--compression', choices=['auto', 'deflate', 'store'],
+                        help="page compression, auto stores images that are already compressed (default)")
+    parser.add_argument('--image-format', choices=['jpeg', 'png', 'webp'],
+                        help="re-encode pages to this format (needs Pillow)")
+    parser.add_argument('--image-quality', type=int, metavar='Q',
+                        help="quality of re-encoded jpeg and webp pages, 1-100 (default 80)")
+    parser.add_argument('--max-image-size', type=str, metavar='WxH',
+                        help="downscale pages larger than this, e.g. 1072x1448 or x1448 (needs Pillow)")
+    parser.add_argument('--memory-limit', type=int, metavar='MB',
+                        help="memory used for page images waiting to be saved, the rest goes to temporary files")
+    parser.add_argument('--rate-limit', type=str, metavar='RATE[:BURST]',
+                        help="requests per second (and burst) allowed to the site")
+    parser.add_argument('-j', '--jobs', type=int, help="number of titles from the config file to download at once")
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help="keep running, checking each title of the config file for new chapters "
+                             "as often as it updates")
+    parser.add_argument('--chapters-ttl', type=int, metavar='MIN',
+                        help="with --watch, reuse a title's chapter list for this many minutes "
+                             "instead of fetching it on every check")
+    parser.add_argument('--metrics', type=str, metavar='FILE',
+                        help="write requests, bytes, retries and stage timings per site to this json file")
+    parser.add_argument('--metrics-prom', type=str, metavar='FILE',
+                        help="write the same as a Prometheus textfile")
+    parser.add_argument('--profile', nargs='?', const='-', metavar='OUT',
+                        help="profile the run and report time spent per stage, site and chapter "
+                             "to stderr or to OUT (and OUT.pstats)")
     parser.add_argument('-v', '--version', action='version',
                         version='{0} {1}'.format(parser.prog, version),
                         help="show program version and exit")
 
     args = parser.parse_args()
-    args.begin = None
-    args.end = None
+    args.ranges = None
     args.volumes = None
 
     if len(sys.argv) <= 1:
         parser.print_help()
         sys.exit()
 
-    if (not args.file) and (not args.title):
+    if (not args.file) and (not args.title) and (not args.verify):
         parser.print_usage()
         sys.exit("{0}: error: must specify either config file or manga title".format(parser.prog))
 
+    if args.repair and not args.verify:
+        parser.print_usage()
+        sys.exit("{0}: error: --repair needs --verify".format(parser.prog))
+
+    if args.watch and not args.file:
+        parser.print_usage()
+        sys.exit("{0}: error: --watch needs a config file".format(parser.prog))
+
     if args.file:
         if not os.path.isfile(args.file):
             parser.print_usage()
             sys.exit("{0}: error: config file does not exist".format(parser.prog))
     if args.chapter:
-        (args.begin, args.end, args.chapter, chapter_valid, args.volumes) = parse_arg_chapter(args.chapter)
+        (args.ranges, chapter_valid, args.volumes) = parse_arg_chapter(args.chapter)
         if (not chapter_valid):
             parser.print_usage()
             sys.exit("{0}: error: invalid chapter interval, the end "
@@ -73,23 +140,13 @@ def cmdparse():
     return args
 
 def parse_arg_chapter(arg_chapter):
-    arg_volumes = None
+    """Returns (ranges, valid, volumes) of a chapter selector, e.g. 1-10,15,20- or v01 v02"""
     if ('v' in arg_chapter.lower()):
-        arg_volumes = arg_chapter.split(' ')
-        return (None, None, None, True, arg_volumes)
-
-    arg_begin = None
-    arg_end = None
-    chapter = arg_chapter.split('-')
-    if len(chapter) == 2:
-        arg_chapter = None
-        arg_begin = chapter[0]
-        arg_end = chapter[1] if chapter[1] else None
-    if arg_begin and arg_end and (int(arg_begin) > int(arg_end)):
-        valid = False
-    else:
-        valid = True
-    return (arg_begin, arg_end, arg_chapter, valid, None)
+        return (None, True, arg_chapter.split(' '))
+    try:
+        return (parse_selector(arg_chapter), True, None)
+    except ValueError:
+        return (None, False, None)
 
 def configparse(filepath):
     """Returns parsed config from an ini file"""
@@ -97,6 +154,26 @@ def configparse(filepath):
     parser.read(filepath)
     config = []
     base_dir = None
+    cache_dir = None
+    cache_size = None
+    index_file = None
+    jobs = 1
+    site_jobs = 2
+    rate_limits = {}
+    memory_limit = None
+    compression = None
+    by_volume = False
+    image_format = None
+    image_quality = None
+    max_image_size = None
+    metrics_file = None
+    metrics_prom = None
+    blob_dir = None
+    blob_size = None
+    ad_hashes = None
+    watch_interval = 10
+    watch_max_interval = 1440
+    chapters_ttl = None
 
     default_site = 'mangahere'
     if parser.has_section('GetManga'):
@@ -106,7 +183,82 @@ def configparse(filepath):
                 base_dir = base_dir + "/"
         if parser.has_option('GetManga', 'site'):
             default_site = parser.get('GetManga', 'site')
-    overall_config = {"base_dir":base_dir}
+        if parser.has_option('GetManga', 'cache_dir'):
+            cache_dir = parser.get('GetManga', 'cache_dir')
+        if parser.has_option('GetManga', 'cache_size'):
+            cache_size = parser.getint('GetManga', 'cache_size')
+        if base_dir != None:
+            index_file = base_dir + ".getmanga.db"
+        if parser.has_option('GetManga', 'index'):
+            index_file = parser.get('GetManga', 'index')
+            if index_file.lower() in ('', 'no', 'none', 'off'):
+                index_file = None
+        if parser.has_option('GetManga', 'jobs'):
+            jobs = parser.getint('GetManga', 'jobs')
+        if parser.has_option('GetManga', 'site_jobs'):
+            site_jobs = parser.getint('GetManga', 'site_jobs')
+        if parser.has_option('GetManga', 'memory_limit'):
+            memory_limit = parser.getint('GetManga', 'memory_limit')
+        if parser.has_option('GetManga', 'compression'):
+            compression = parser.get('GetManga', 'compression')
+            if compression not in ('auto', 'deflate', 'store'):
+                raise MangaException('Config Error: compression must be auto, deflate or store')
+        if parser.has_option('GetManga', 'by_volume'):
+            by_volume = parser.getboolean('GetManga', 'by_volume')
+        if parser.has_option('GetManga', 'image_format'):
+            image_format = parser.get('GetManga', 'image_format')
+        if parser.has_option('GetManga', 'image_quality'):
+            image_quality = parser.getint('GetManga', 'image_quality')
+        if parser.has_option('GetManga', 'max_image_size'):
+            max_image_size = parser.get('GetManga', 'max_image_size')
+        if parser.has_option('GetManga', 'blob_dir'):
+            blob_dir = parser.get('GetManga', 'blob_dir')
+        if parser.has_option('GetManga', 'blob_size'):
+            blob_size = parser.getint('GetManga', 'blob_size')
+        if parser.has_option('GetManga', 'ad_hashes'):
+            ad_hashes = parser.get('GetManga', 'ad_hashes')
+        if parser.has_option('GetManga', 'watch_interval'):
+            watch_interval = parser.getint('GetManga', 'watch_interval')
+        if parser.has_option('GetManga', 'watch_max_interval'):
+            watch_max_interval = parser.getint('GetManga', 'watch_max_interval')
+        if parser.has_option('GetManga', 'chapters_ttl'):
+            chapters_ttl = parser.getint('GetManga', 'chapters_ttl')
+        if parser.has_option('GetManga', 'metrics'):
+            metrics_file = parser.get('GetManga', 'metrics')
+        if parser.has_option('GetManga', 'metrics_prom'):
+            metrics_prom = parser.get('GetManga', 'metrics_prom')
+        if parser.has_option('GetManga', 'rate_limit'):
+            # e.g. "mangahere=1:3, mangafox=4"
+            for item in parser.get('GetManga', 'rate_limit').split(','):
+                site, _, value = item.partition('=')
+                site = site.strip()
+                if site not in SITES:
+                    raise MangaException('Config Error: unknown site in rate_limit: %s' % site)
+                try:
+                    rate_limits[site] = RateLimiter.parse(value)
+                except ValueError as msg:
+                    raise MangaException('Config Error: %s' % msg)
+    overall_config = {"base_dir":base_dir,
+                      "cache_dir":cache_dir,
+                      "cache_size":cache_size,
+                      "index":index_file,
+                      "jobs":jobs,
+                      "site_jobs":site_jobs,
+                      "rate_limits":rate_limits,
+                      "memory_limit":memory_limit,
+                      "compression":compression,
+                      "by_volume":by_volume,
+                      "image_format":image_format,
+                      "image_quality":image_quality,
+                      "max_image_size":max_image_size,
+                      "blob_dir":blob_dir,
+                      "blob_size":blob_size,
+                      "ad_hashes":ad_hashes,
+                      "watch_interval":watch_interval,
+                      "watch_max_interval":max(watch_max_interval, watch_interval),
+                      "chapters_ttl":chapters_ttl,
+                      "metrics":metrics_file,
+                      "metrics_prom":metrics_prom}
     for section in parser.sections():
         if section != "GetManga":
             # skip the overall config
@@ -130,55 +282,71 @@ def configparse(filepath):
 
 def main():
     args = cmdparse()
+    if not args.profile:
+        return run(args)
+
+    profiler = Profiler()
+    MangaSite.metrics.observers.append(profiler.observe)
+    profiler.start()
+    try:
+        run(args)
+    finally:
+        profiler.stop()
+        profiler.report(args.profile)
 
 
+def run(args):
+    """Downloads what the command line or config file asks for"""
+    metrics_file = args.metrics
+    metrics_prom = args.metrics_prom
+
+    if args.watch:
+        watchConfig(args)
+        return
+    if args.verify:
+        try:
+            verifyLibrary(args)
+        except MangaException as msg:
+            print('%s' % (msg))
+        return
     if args.file:
-        (overall_config, config) = configparse(args.file)
-        base_dir = overall_config["base_dir"]
-        if (base_dir != None):
-            if base_dir[-1] != "/":
-                base_dir = base_dir + "/"
+        (overall_config, config, settings) = loadConfig(args)
+        metrics_file = metrics_file or overall_config["metrics"]
+        metrics_prom = metrics_prom or overall_config["metrics_prom"]
+        batch = settings["batch"]
         for (site, title, this_dir, arg_chapter) in config:
-            try:
-                manga = GetManga(site, title)
-                if (this_dir == None):
-                    if (base_dir == None):
-                        sys.exit("Error: must define either dir or base_dir in config file.")
-                    else:
-                        clean_title = manga.manga.title.lower().replace("-","_")
-                        this_dir = base_dir + clean_title
-                manga.path = this_dir
-                if arg_chapter.strip().lower() == 'all':
-                    for chapter in manga.chapters:
-                        manga.get(chapter)
-                elif arg_chapter.strip().lower() == 'latest':
-                    manga.get(manga.latest)
-                elif arg_chapter.strip().lower() == 'new':
-                    manga.getNewChapters()
-                else:
-                    (arg_begin, arg_end, arg_chapter, chapter_valid, arg_volumes) = parse_arg_chapter(arg_chapter)
-                    if (chapter_valid):
-                        if (arg_volumes != None):
-                            downloadVolumes(manga, arg_volumes)
-                        else:
-                            downloadChapters(manga, arg_chapter, arg_begin, arg_end)
-                    else:
-                        print title + ": invalid chapter interval"
-            except MangaException as msg:
-                print('%s: %s' % (title,msg))
+            batch.add(site, title, downloadSection, site, title, this_dir, arg_chapter, settings)
+        batch.run()
     else:
         try:
+            if args.rate_limit:
+                try:
+                    SITES[args.site].rate_limiter = RateLimiter.parse(args.rate_limit)
+                except ValueError as msg:
+                    raise MangaException(msg)
             manga = GetManga(args.site, args.title)
+            if args.cache_dir:
+                manga.manga.http_cache = HttpCache(args.cache_dir, (args.cache_size or CACHE_SIZE) * 1024 * 1024)
+            if args.index:
+                manga.index = DownloadIndex(args.index)
+            manga.blobs = openBlobStore(args.blob_dir, args.blob_size, args.ad_hashes)
+            if args.compression:
+                manga.compression = args.compression
+            manga.by_volume = args.by_volume
+            manga.transcoder = openTranscoder(args.image_format, args.image_quality, args.max_image_size)
+            if args.memory_limit:
+                manga.memory_limit = args.memory_limit * 1024 * 1024
             if args.dir:
                 manga.path = args.dir
 
-            if args.all:
-                for chapter in manga.chapters:
-                    manga.get(chapter)
+            if args.reindex:
+                manga.reindex()
+            elif args.all:
+                manga.getChapters(manga.chapters)
             elif args.volumes:
                 downloadVolumes(manga, args.volumes)
-            elif (args.chapter or args.begin):
-                downloadChapters(manga, args.chapter, args.begin, args.end)
+            elif args.ranges:
+                downloadChapters(manga, args.ranges)
             elif args.latest:
                 # last chapter
                 manga.get(manga.latest)
@@ -190,69 +358,306 @@ def main():
             else:
                 numnew = manga.numNewChapters()
                 if (numnew == 0):
-                    print "No new chapters available"
+                    print("No new chapters available")
                 elif (numnew == 1):
-                    print "1 new chapter available"
+                    print("1 new chapter available")
                 else:
-                    print str(numnew) + " new chapters available"
+                    print(str(numnew) + " new chapters available")
         except MangaException as msg:
             print('%s' % (msg))
 
+    reportRetries()
+    writeMetrics(metrics_file, metrics_prom)
 
-def downloadVolumes(manga, arg_volumes):
+
+def loadConfig(args):
+    """Returns the overall config, the titles and the download settings of
+    the config file, the command line taking precedence"""
+    http_cache = None
+    index = None
+    (overall_config, config) = configparse(args.file)
+    base_dir = overall_config["base_dir"]
+    cache_dir = args.cache_dir if args.cache_dir is not None else overall_config["cache_dir"]
+    cache_size = args.cache_size if args.cache_size is not None else overall_config["cache_size"]
+    if cache_dir:
+        http_cache = HttpCache(cache_dir, (cache_size or CACHE_SIZE) * 1024 * 1024)
+    index_file = args.index or overall_config["index"]
+    if index_file:
+        index = DownloadIndex(index_file)
+    blob_size = args.blob_size if args.blob_size is not None else overall_config["blob_size"]
+    blobs = openBlobStore(args.blob_dir or overall_config["blob_dir"], blob_size,
+                          args.ad_hashes or overall_config["ad_hashes"])
+    for site, rate_limiter in overall_config["rate_limits"].items():
+        SITES[site].rate_limiter = rate_limiter
+    if (base_dir != None):
+        if base_dir[-1] != "/":
+            base_dir = base_dir + "/"
+    jobs = args.jobs or overall_config["jobs"]
+    settings = {"base_dir":base_dir,
+                "http_cache":http_cache,
+                "index":index,
+                "blobs":blobs,
+                "reindex":args.reindex,
+                "memory_limit":args.memory_limit or overall_config["memory_limit"],
+                "compression":args.compression or overall_config["compression"],
+                "by_volume":args.by_volume or overall_config["by_volume"],
+                "chapters_ttl":args.chapters_ttl if args.chapters_ttl is not None else overall_config["chapters_ttl"],
+                # site instances of the titles, kept between checks while watching
+                "sites":{},
+                "transcoder":openTranscoder(args.image_format or overall_config["image_format"],
+                                            args.image_quality or overall_config["image_quality"],
+                                            args.max_image_size or overall_config["max_image_size"]),
+                # progress bars of titles running side by side would mix
+                "progress":jobs == 1,
+                "batch":Batch(jobs, overall_config["site_jobs"])}
+    return (overall_config, config, settings)
+
+
+def watchConfig(args):
+    """Checks the titles of the config file for new chapters until interrupted,
+    each on its own schedule, reloading the file whenever it changes"""
+    schedule = None
+    mtime = None
+    sections = {}
+    while True:
+        try:
+            current = os.path.getmtime(args.file)
+        except OSError:
+            # being replaced, keep what we have
+            current = mtime
+        if schedule is None or current != mtime:
+            mtime = current
+            try:
+                (overall_config, config, new_settings) = loadConfig(args)
+            except (MangaException, configparser.Error, ValueError) as msg:
+                if schedule is None:
+                    raise MangaException(msg)
+                print('%s: %s, still using the previous config' % (args.file, msg))
+            else:
+                if schedule is not None:
+                    closeSettings(settings)
+                settings = new_settings
+                metrics_file = args.metrics or overall_config["metrics"]
+                metrics_prom = args.metrics_prom or overall_config["metrics_prom"]
+                if schedule is None:
+                    schedule = Schedule()
+                schedule.min_interval = overall_config["watch_interval"] * 60
+                schedule.max_interval = overall_config["watch_max_interval"] * 60
+                sections = dict(((site, title), (this_dir, arg_chapter))
+                                for (site, title, this_dir, arg_chapter) in config)
+                schedule.update(sections)
+                print('watching %d titles from %s' % (len(sections), args.file))
+
+        due = schedule.due()
+        if due:
+            # a new Batch each round, the last one has finished its queue
+            batch = settings["batch"] = Batch(settings["batch"].jobs, settings["batch"].site_jobs)
+            for (site, title) in due:
+                (this_dir, arg_chapter) = sections[(site, title)]
+                batch.add(site, title, watchSection, schedule, site, title, this_dir, arg_chapter, settings)
+            try:
+                batch.run()
+            except KeyboardInterrupt:
+                break
+            writeMetrics(metrics_file, metrics_prom)
+
+        wait = schedule.wait()
+        try:
+            sleep(WATCH_RELOAD if wait is None else min(wait, WATCH_RELOAD))
+        except KeyboardInterrupt:
+            break
+    reportRetries()
+    writeMetrics(metrics_file, metrics_prom)
+    closeSettings(settings)
+
+
+def watchSection(schedule, site, title, this_dir, arg_chapter, settings):
+    """Downloads a title of the config file and schedules its next check"""
+    latest = None
     try:
-        for chapter in manga.chapters:
-            volume = chapter.volume
-            if volume != None:
-                if volume in arg_volumes:
-                    manga.get(chapter)
+        manga = downloadSection(site, title, this_dir, arg_chapter, settings)
+        if manga is not None:
+            # "new" knows without going through the whole chapter list
+            latest = manga.newest or manga.latest.name
     except MangaException as msg:
-        raise msg
+        print('%s: %s' % (title, msg))
+    finally:
+        schedule.done((site, title), latest)
+
+
+def verifyLibrary(args):
+    """Checks every archive under args.verify; with args.repair broken ones
+    are moved aside and downloaded again, if the index knows where from"""
+    index = None
+    index_file = args.index or os.path.join(args.verify, '.getmanga.db')
+    if args.index or os.path.isfile(os.path.expanduser(index_file)):
+        index = DownloadIndex(index_file)
+
+    checked = 0
+    broken = []
+    for (cbz_file, problem) in verify(args.verify):
+        checked += 1
+        if problem is not None:
+            print('%s: %s' % (cbz_file, problem))
+            broken.append(cbz_file)
+    print('%d archives checked, %d broken' % (checked, len(broken)))
+    if not (args.repair and broken):
+        return
+
+    # (site, title, dir) -> names of the archives to download again
+    titles = {}
+    for cbz_file in broken:
+        row = index.archive(cbz_file) if index is not None else None
+        bad_file = cbz_file + os.path.extsep + 'bad'
+        if os.name == 'nt' and os.path.isfile(bad_file):
+            os.remove(bad_file)
+        os.rename(cbz_file, bad_file)
+        if index is not None:
+            index.remove(cbz_file)
+        if row is None or not (row[2] and row[3] in SITES):
+            print('moved %s to %s, download it again yourself' % (cbz_file, bad_file))
+            continue
+        (path, name, title, site) = row
+        titles.setdefault((site, title, path), set()).add(name)
+
+    for (site, title, path), names in sorted(titles.items()):
+        try:
+            manga = GetManga(site, title)
+            manga.path = path
+            manga.index = index
+            # a volume archive has the name of its chapters up to _c<number>
+            chapters = [chapter for chapter in manga.chapters
+                        if chapter.name in names or
+                        (chapter.volume is not None and chapter.name.rsplit('_c', 1)[0] in names)]
+            manga.by_volume = any(chapter.name not in names for chapter in chapters)
+            manga.getChapters(chapters)
+        except MangaException as msg:
+            print('%s: %s' % (title, msg))
+
+
+def openBlobStore(blob_dir, blob_size, ad_hashes_file):
+    """Returns the BlobStore asked for, or None"""
+    if not blob_dir:
+        if ad_hashes_file:
+            raise MangaException("ad hashes need a blob directory to look pages up")
+        return None
+    ad_hashes = None
+    if ad_hashes_file:
+        try:
+            ad_hashes = BlobStore.load_hashes(ad_hashes_file)
+        except IOError as msg:
+            raise MangaException(msg)
+    if blob_size is None:
+        blob_size = BLOB_SIZE
+    max_size = blob_size * 1024 * 1024 if blob_size else None
+    return BlobStore(blob_dir, ad_hashes, max_size)
+
+
+def openTranscoder(image_format, image_quality, max_image_size):
+    """Returns the Transcoder asked for, or None"""
+    if not (image_format or max_image_size):
+        return None
+    # Pillow is only needed when asked for
+    from getmanga.transcode import Transcoder
+    max_width = max_height = None
+    if max_image_size:
+        try:
+            (max_width, max_height) = Transcoder.parse_size(max_image_size)
+        except ValueError as msg:
+            raise MangaException(msg)
+    return Transcoder(image_format, image_quality or 80, max_width, max_height)
+
 
-def downloadChapters(manga, arg_chapter, arg_begin, arg_end):
+def closeSettings(settings):
+    """Closes the index and stops the transcoding processes of settings"""
+    if settings["index"] is not None:
+        settings["index"].close()
+    if settings["transcoder"] is not None:
+        settings["transcoder"].close()
+
+
+def writeMetrics(metrics_file, metrics_prom):
+    """Writes what was recorded during the run to the files asked for"""
     try:
-        if arg_chapter:
-            # single chapter
-            # actually, also download decimal chapters (e.g. 12 will download 12.1, 12.2, etc)
-            exist = False
-            for chapter in manga.chapters:
-                try:
-                    if int(float(chapter.number)) == int(float(arg_chapter)):
-                        manga.get(chapter)
-                        exist = True
-                except ValueError:
-                    if chapter.number == arg_chapter:
-                        manga.get(chapter)
-                        exist = True
-            if (not exist):
-                print("Chapter doesn't exist.")
-
-        elif arg_begin:
-            # download range
-            start = None
-            stop = None
-            for index, chapter in enumerate(manga.chapters):
-                # take the floor of chapter numbers.
-                # so, if we are asked to download 1-2, include 1.1, 1.2, 1.3, etc.
-                try:
-                    if (start == None) and (int(float(chapter.number)) == int(float(arg_begin))):
-                        start = index
-                except ValueError:
-                    if (start == None) and (chapter.number == arg_begin):
-                        start = index
-                try:
-                    if arg_end and int(float(chapter.number)) == int(float(arg_end)):
-                        stop = index + 1
-                except ValueError:
-                    if arg_end and (chapter.number == arg_end):
-                        stop = index + 1
-            if (start != None) and ((stop != None) or (arg_end == None)):
-                for chapter in manga.chapters[start:stop]:
-                    manga.get(chapter)
+        if metrics_file:
+            MangaSite.metrics.write_json(metrics_file)
+        if metrics_prom:
+            MangaSite.metrics.write_prometheus(metrics_prom)
+    except (IOError, OSError) as msg:
+        print('could not write metrics: %s' % msg)
+
+
+def reportRetries():
+    """Prints how many requests had to be retried on each site"""
+    retries = MangaSite.retry_policy.retries
+    if retries:
+        print('retries: ' + ', '.join('%s %d' % (site, retries[site]) for site in sorted(retries)))
+
+
+def downloadSection(site, title, this_dir, arg_chapter, settings):
+    """Downloads a title from the config file, returns its GetManga or None
+    if it failed"""
+    try:
+        manga = GetManga(site, title)
+        if settings["chapters_ttl"] is not None:
+            # a watched title checked again keeps its chapter list that long
+            manga.manga = settings["sites"].setdefault((site, title), manga.manga)
+            manga.manga.chapters_ttl = settings["chapters_ttl"] * 60
+        manga.manga.http_cache = settings["http_cache"]
+        manga.index = settings["index"]
+        manga.blobs = settings["blobs"]
+        manga.show_progress = settings["progress"]
+        # titles of a site running side by side share its connections
+        manga.manga.connections = manga.concurrency * settings["batch"].site_limit(site)
+        if settings["compression"]:
+            manga.compression = settings["compression"]
+        manga.by_volume = settings["by_volume"]
+        manga.transcoder = settings["transcoder"]
+        if settings["memory_limit"]:
+            manga.memory_limit = settings["memory_limit"] * 1024 * 1024
+        if (this_dir == None):
+            if (settings["base_dir"] == None):
+                raise MangaException("must define either dir or base_dir in config file.")
+            else:
+                clean_title = manga.manga.title.lower().replace("-","_")
+                this_dir = settings["base_dir"] + clean_title
+        manga.path = this_dir
+        if settings["reindex"]:
+            manga.reindex()
+        elif arg_chapter.strip().lower() == 'all':
+            manga.getChapters(manga.chapters)
+        elif arg_chapter.strip().lower() == 'latest':
+            manga.get(manga.latest)
+        elif arg_chapter.strip().lower() == 'new':
+            manga.getNewChapters()
+        else:
+            (ranges, chapter_valid, arg_volumes) = parse_arg_chapter(arg_chapter)
+            if (chapter_valid):
+                if (arg_volumes != None):
+                    downloadVolumes(manga, arg_volumes)
+                else:
+                    downloadChapters(manga, ranges)
             else:
-                print(manga.title + ": Bad chapter indices provided")
+                print(title + ": invalid chapter interval")
+        return manga
     except MangaException as msg:
-        raise msg
+        print('%s: %s' % (title,msg))
+
+def downloadVolumes(manga, arg_volumes):
+    """Downloads the chapters of volumes, e.g. ['v01', 'v02']"""
+    manga.getChapters(ChapterCatalog(manga.chapters).volumes(arg_volumes))
+
+def downloadChapters(manga, ranges):
+    """Downloads the chapters of ranges from parse_selector; asking for 12
+    (or 1-12) also gets 12.1, 12.2, etc"""
+    (chapters, missing) = ChapterCatalog(manga.chapters).select(ranges)
+    for (first, last) in missing:
+        if first == last:
+            print("Chapter %s doesn't exist." % first)
+        else:
+            print("%s: Bad chapter indices provided: %s-%s" % (manga.title, first, last or ''))
+    if chapters:
+        manga.getChapters(chapters)
 
 if __name__ == '__main__':
     main()
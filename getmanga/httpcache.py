@@ -0,0 +1,114 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import hashlib
+import json
+import os
+import tempfile
+from threading import Lock
+
+
+class HttpCache(object):
+    """On-disk cache of html responses, revalidated with conditional requests"""
+    def __init__(self, path, max_size=64 * 1024 * 1024):
+        self.path = os.path.expanduser(path)
+        self.max_size = max_size
+        self._size = None
+        self._lock = Lock()
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def _entry_file(self, uri):
+        """Returns file name of cache entry for uri"""
+        key = hashlib.sha1(uri.encode('utf8')).hexdigest()
+        return os.path.join(self.path, key + os.path.extsep + 'json')
+
+    def get(self, uri):
+        """Returns cached entry for uri, or None"""
+        entry_file = self._entry_file(uri)
+        try:
+            with open(entry_file, 'rb') as f:
+                entry = json.loads(f.read().decode('utf8'))
+            # mtime is used as the last access time for eviction
+            os.utime(entry_file, None)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('uri') != uri:
+            return None
+        return entry
+
+    @staticmethod
+    def validators(entry):
+        """Returns conditional request headers for a cached entry"""
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, uri, resp):
+        """Stores a response if the server gave us something to revalidate with"""
+        etag = resp.headers.get('etag')
+        last_modified = resp.headers.get('last-modified')
+        if resp.status_code != 200 or not (etag or last_modified):
+            return
+        data = json.dumps({'uri': uri,
+                           'etag': etag,
+                           'last_modified': last_modified,
+                           'text': resp.text}).encode('utf8')
+
+        entry_file = self._entry_file(uri)
+        with self._lock:
+            self._load_size()
+            try:
+                self._size -= os.path.getsize(entry_file)
+            except OSError:
+                pass
+            fd, tmp_file = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            try:
+                os.write(fd, data)
+                os.close(fd)
+                if os.name == 'nt' and os.path.isfile(entry_file):
+                    os.remove(entry_file)
+                os.rename(tmp_file, entry_file)
+            except OSError:
+                if os.path.isfile(tmp_file):
+                    os.remove(tmp_file)
+                return
+            self._size += len(data)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _load_size(self):
+        """Computes the size of the cache on first use"""
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        """Yields (file, size, mtime) of every cache entry"""
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'):
+                continue
+            entry_file = os.path.join(self.path, name)
+            try:
+                stat = os.stat(entry_file)
+            except OSError:
+                continue
+            yield entry_file, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        """Removes least recently used entries until well under the size cap"""
+        # shrink to 90% so a full cache doesn't evict on every store
+        target = self.max_size * 0.9
+        for entry_file, size, _ in sorted(self._entries(), key=lambda e: e[2]):
+            if self._size <= target:
+                break
+            try:
+                os.remove(entry_file)
+            except OSError:
+                continue
+            self._size -= size
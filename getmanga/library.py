@@ -0,0 +1,171 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import os
+import re
+import sqlite3
+from threading import Lock
+from zipfile import BadZipfile, ZipFile
+
+
+class DownloadIndex(object):
+    """SQLite index of downloaded chapters, so we don't have to stat every archive"""
+    def __init__(self, db_file):
+        self.db_file = os.path.expanduser(db_file)
+        db_dir = os.path.dirname(self.db_file)
+        if db_dir and not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+
+        self._lock = Lock()
+        self._db = sqlite3.connect(self.db_file, check_same_thread=False)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(watermarks)")]
+        if columns and 'title' not in columns:
+            # one watermark per directory before, the next look for new
+            # chapters finds them again
+            self._db.execute("DROP TABLE watermarks")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS chapters (
+                path TEXT PRIMARY KEY,
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                title TEXT,
+                site TEXT,
+                number TEXT,
+                size INTEGER,
+                pages INTEGER);
+            CREATE INDEX IF NOT EXISTS chapters_dir ON chapters (dir);
+            CREATE TABLE IF NOT EXISTS dirs (
+                dir TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS watermarks (
+                dir TEXT NOT NULL,
+                site TEXT NOT NULL,
+                title TEXT NOT NULL,
+                name TEXT NOT NULL,
+                uri TEXT NOT NULL,
+                fingerprint TEXT,
+                PRIMARY KEY (dir, site, title));
+            """)
+
+    def close(self):
+        """Closes the database"""
+        with self._lock:
+            self._db.close()
+
+    def downloaded(self, path):
+        """Returns names of the chapters downloaded into path"""
+        path = self._normpath(path)
+        with self._lock:
+            self._know(path)
+            rows = self._db.execute("SELECT name FROM chapters WHERE dir = ?", (path,))
+            return set(name for (name,) in rows)
+
+    def add(self, cbz_file, title, site, number, pages):
+        """Records a completed chapter archive"""
+        cbz_file = self._normpath(cbz_file)
+        path, cbz_name = os.path.split(cbz_file)
+        name = os.path.splitext(cbz_name)[0]
+        with self._lock:
+            self._know(path)
+            self._db.execute("INSERT OR IGNORE INTO chapters VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (cbz_file, path, name, title, site, number, None, None))
+            # an archive found on disk again comes without its pages, keep those known
+            self._db.execute("UPDATE chapters SET title = COALESCE(?, title), site = COALESCE(?, site), "
+                             "number = COALESCE(?, number), size = ?, pages = COALESCE(?, pages) "
+                             "WHERE path = ?",
+                             (title, site, number, os.path.getsize(cbz_file), pages, cbz_file))
+            self._db.commit()
+
+    def remove(self, cbz_file):
+        """Forgets a chapter archive"""
+        cbz_file = self._normpath(cbz_file)
+        path, cbz_name = os.path.split(cbz_file)
+        with self._lock:
+            self._db.execute("DELETE FROM chapters WHERE path = ?", (cbz_file,))
+            self._db.execute("DELETE FROM watermarks WHERE dir = ? AND name = ?",
+                             (path, os.path.splitext(cbz_name)[0]))
+            self._db.commit()
+
+    def archive(self, cbz_file):
+        """Returns (dir, name, title, site) recorded for an archive, or None"""
+        with self._lock:
+            return self._db.execute("SELECT dir, name, title, site FROM chapters WHERE path = ?",
+                                    (self._normpath(cbz_file),)).fetchone()
+
+    def watermark(self, path, site, title):
+        """Returns (name, uri, index fingerprint) of the newest chapter of title
+        on site downloaded into path, or None"""
+        with self._lock:
+            return self._db.execute("SELECT name, uri, fingerprint FROM watermarks "
+                                    "WHERE dir = ? AND site = ? AND title = ?",
+                                    (self._normpath(path), site, title)).fetchone()
+
+    def set_watermark(self, path, site, title, name, uri, fingerprint=None):
+        """Records the newest chapter of title on site downloaded into path;
+        fingerprint is that of the index page it was the newest chapter on, if it was"""
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?, ?, ?)",
+                             (self._normpath(path), site, title, name, uri, fingerprint))
+            self._db.commit()
+
+    def sync(self, path, title=None, site=None):
+        """Rebuilds the records of path from the archives on disk"""
+        path = self._normpath(path)
+        with self._lock:
+            # the archives may not be what the watermark says anymore
+            self._db.execute("DELETE FROM watermarks WHERE dir = ?", (path,))
+            self._sync(path, title, site, read_archives=True)
+
+    def _know(self, path):
+        """Takes the archives already in path the first time we see it"""
+        if not self._db.execute("SELECT 1 FROM dirs WHERE dir = ?", (path,)).fetchone():
+            self._sync(path, None, None, read_archives=False)
+
+    def _sync(self, path, title, site, read_archives):
+        """Records the archives on disk in path, keeping what is known of
+        those recorded already; reading the archives forgets those that are gone"""
+        rows = []
+        if os.path.isdir(path):
+            for cbz_name in os.listdir(path):
+                name, ext = os.path.splitext(cbz_name)
+                if ext != os.path.extsep + 'cbz':
+                    continue
+                cbz_file = os.path.join(path, cbz_name)
+                size = pages = None
+                if read_archives:
+                    size = os.path.getsize(cbz_file)
+                    try:
+                        with ZipFile(cbz_file) as cbz:
+                            pages = len(cbz.namelist())
+                    except (BadZipfile, IOError):
+                        pass
+                rows.append((cbz_file, path, name, title, site,
+                             self._get_chapter_number(name), size, pages))
+
+        if read_archives:
+            found = set(row[0] for row in rows)
+            gone = [(cbz_file,) for (cbz_file,) in
+                    self._db.execute("SELECT path FROM chapters WHERE dir = ?", (path,))
+                    if cbz_file not in found]
+            self._db.executemany("DELETE FROM chapters WHERE path = ?", gone)
+        self._db.executemany("INSERT OR IGNORE INTO chapters VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        if read_archives:
+            self._db.executemany("UPDATE chapters SET title = COALESCE(?, title), site = COALESCE(?, site), "
+                                 "size = ?, pages = COALESCE(?, pages) WHERE path = ?",
+                                 [(title, site, size, pages, cbz_file)
+                                  for (cbz_file, _, _, title, site, _, size, pages) in rows])
+        self._db.execute("INSERT OR REPLACE INTO dirs VALUES (?)", (path,))
+        self._db.commit()
+
+    @staticmethod
+    def _normpath(path):
+        return os.path.abspath(os.path.expanduser(path))
+
+    @staticmethod
+    def _get_chapter_number(name):
+        """Returns chapter number from an archive name, e.g. fairy_tail_v01_c002.5"""
+        number = re.search(r'_c([0-9][0-9.]*)$', name)
+        if number:
+            return re.sub(r'^0+(?=[0-9])', '', number.group(1))
+        return None
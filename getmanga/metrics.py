@@ -0,0 +1,128 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from threading import Lock
+from time import time
+
+
+# counter name, name of its second label, help text
+COUNTERS = (('requests', 'kind', 'HTTP requests sent'),
+            ('bytes', 'kind', 'Bytes received'),
+            ('retries', 'reason', 'Requests sent again'),
+            ('failures', 'reason', 'Requests and chapters given up on'),
+            ('blobs', 'result', 'Page images looked up in the image store'),
+            ('transcodes', 'result', 'Page images re-encoded or resized'))
+
+
+class Metrics(object):
+    """Counters and stage timings per site, safe to update from any thread"""
+    # upper bounds in seconds of the stage histograms
+    buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.counters = {}
+        self.stages = {}
+        # called with (stage, site, chapter, seconds) of every observation
+        self.observers = []
+        self._lock = Lock()
+
+    def count(self, name, site, label, value=1):
+        """Adds value to counter name of site, e.g. count('retries', 'mangafox', '429')"""
+        key = (name, site, str(label))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, stage, site, seconds, chapter=None):
+        """Records that a stage of site (and chapter) took seconds"""
+        key = (stage, site)
+        with self._lock:
+            histogram = self.stages.get(key)
+            if histogram is None:
+                histogram = self.stages[key] = {'buckets': [0] * len(self.buckets),
+                                                'count': 0, 'sum': 0.0, 'max': 0.0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+        for observer in self.observers:
+            observer(stage, site, chapter, seconds)
+
+    @contextmanager
+    def timer(self, stage, site, chapter=None):
+        """Times the with block as stage of site"""
+        start = time()
+        try:
+            yield
+        finally:
+            self.observe(stage, site, time() - start, chapter)
+
+    def summary(self):
+        """Returns everything recorded, grouped by site"""
+        sites = {}
+        with self._lock:
+            for (name, site, label), value in self.counters.items():
+                sites.setdefault(site, {}).setdefault(name, {})[label] = value
+            for (stage, site), histogram in self.stages.items():
+                sites.setdefault(site, {}).setdefault('seconds', {})[stage] = {
+                    'count': histogram['count'],
+                    'sum': round(histogram['sum'], 6),
+                    'mean': round(histogram['sum'] / histogram['count'], 6),
+                    'max': round(histogram['max'], 6)}
+        return sites
+
+    def prometheus(self):
+        """Returns everything recorded in the Prometheus text format"""
+        lines = []
+        with self._lock:
+            for name, label_name, help_text in COUNTERS:
+                metric = 'getmanga_{0}_total'.format(name)
+                lines.append('# HELP {0} {1}'.format(metric, help_text))
+                lines.append('# TYPE {0} counter'.format(metric))
+                for (counter, site, label), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append('{0}{{site="{1}",{2}="{3}"}} {4}'.format(metric, site, label_name, label, value))
+
+            metric = 'getmanga_stage_seconds'
+            lines.append('# HELP {0} Time spent in each download stage'.format(metric))
+            lines.append('# TYPE {0} histogram'.format(metric))
+            for (stage, site), histogram in sorted(self.stages.items()):
+                labels = 'site="{0}",stage="{1}"'.format(site, stage)
+                total = 0
+                for bound, observed in zip(self.buckets, histogram['buckets']):
+                    total += observed
+                    lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(metric, labels, bound, total))
+                lines.append('{0}_bucket{{{1},le="+Inf"}} {2}'.format(metric, labels, histogram['count']))
+                lines.append('{0}_sum{{{1}}} {2!r}'.format(metric, labels, histogram['sum']))
+                lines.append('{0}_count{{{1}}} {2}'.format(metric, labels, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, filepath):
+        """Writes the summary to filepath"""
+        _write(filepath, json.dumps(self.summary(), indent=2, sort_keys=True, separators=(',', ': ')) + '\n')
+
+    def write_prometheus(self, filepath):
+        """Writes a textfile for the node exporter's textfile collector"""
+        _write(filepath, self.prometheus())
+
+
+def _write(filepath, content):
+    """Replaces filepath with content at once, so readers never see half a file"""
+    filepath = os.path.expanduser(filepath)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filepath)), prefix='.getmanga-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, filepath)
+    except Exception:
+        os.remove(tmp)
+        raise
@@ -0,0 +1,125 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import cProfile
+import pstats
+import sys
+import threading
+from threading import Lock
+from time import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+# in pipeline order; write_wait is the archive writer waiting for downloads,
+# queue_wait a page waiting for a free worker
+STAGES = ('index', 'pages', 'image_uri', 'queue_wait', 'download', 'transcode', 'write_wait', 'zip_write')
+
+
+class Profiler(object):
+    """cProfile of every thread of a run, plus wall time of each download stage
+    per site and chapter (fed by Metrics.observers)"""
+    def __init__(self):
+        self.sites = {}
+        self.chapters = {}
+        self.start_time = None
+        self.wall = 0
+
+        self._profiles = []
+        self._lock = Lock()
+
+    def start(self):
+        """Starts profiling this thread and every thread started from now on"""
+        self.start_time = time()
+        threading.setprofile(self._profile_thread)
+        self._profile_thread()
+
+    def stop(self):
+        """Stops profiling"""
+        threading.setprofile(None)
+        with self._lock:
+            for profile in self._profiles:
+                profile.disable()
+        self.wall = time() - self.start_time
+
+    def observe(self, stage, site, chapter, seconds):
+        """Adds seconds to the stage of site and chapter"""
+        with self._lock:
+            _add(self.sites.setdefault(site, {}), stage, seconds)
+            if chapter is not None:
+                _add(self.chapters.setdefault((site, chapter), {}), stage, seconds)
+
+    def report(self, out='-'):
+        """Writes stage timings and the busiest functions to out, '-' for
+        stderr; the raw profile goes to out.pstats for other tools"""
+        text = StringIO()
+        text.write('wall time {0:.2f}s\n\n'.format(self.wall))
+        text.write('seconds per stage and site (count), stages of a chapter overlap\n')
+        self._table(text, 'site', sorted(self.sites.items()))
+        text.write('\nseconds per stage and chapter\n')
+        self._table(text, 'chapter', [(chapter, stages) for (site, chapter), stages in sorted(self.chapters.items())])
+
+        stats = self.stats(text)
+        if stats is not None:
+            for order, title in (('cumulative', 'cumulative time'), ('tottime', 'time spent in the function itself')):
+                text.write('\nfunctions by {0}, all threads\n'.format(title))
+                stats.sort_stats(order).print_stats(25)
+
+        if out == '-':
+            sys.stderr.write(text.getvalue())
+            return
+        with open(out, 'w') as f:
+            f.write(text.getvalue())
+        if stats is not None:
+            stats.dump_stats(out + '.pstats')
+
+    def stats(self, stream=None):
+        """Returns pstats.Stats of every profiled thread, None if none had calls"""
+        stats = None
+        with self._lock:
+            for profile in self._profiles:
+                try:
+                    if stats is None:
+                        stats = pstats.Stats(profile, stream=stream)
+                    else:
+                        stats.add(profile)
+                except TypeError:
+                    # no calls recorded in that thread
+                    continue
+        return stats
+
+    def _profile_thread(self, *args):
+        """Runs once in each new thread, replacing itself with a cProfile"""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # newer pythons only allow one cProfile at a time
+            sys.setprofile(None)
+            return
+        with self._lock:
+            self._profiles.append(profile)
+
+    @staticmethod
+    def _table(text, name, rows):
+        width = max([len(name)] + [len(str(row)) for row, _ in rows])
+        text.write('{0:<{1}}'.format(name, width))
+        for stage in STAGES:
+            text.write(' {0:>16}'.format(stage))
+        text.write('\n')
+        for row, stages in rows:
+            text.write('{0:<{1}}'.format(row, width))
+            for stage in STAGES:
+                seconds, count = stages.get(stage, (0, 0))
+                text.write(' {0:>16}'.format('{0:.2f} ({1})'.format(seconds, count) if count else '-'))
+            text.write('\n')
+
+
+def _add(stages, stage, seconds):
+    total, count = stages.get(stage, (0, 0))
+    stages[stage] = (total + seconds, count + 1)
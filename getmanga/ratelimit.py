@@ -0,0 +1,107 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import os
+import re
+import tempfile
+from threading import Lock
+from time import sleep, time
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+try:
+    import fcntl
+except ImportError:
+    # no lock files on this platform, only threads of this process share buckets
+    fcntl = None
+
+
+class RateLimiter(object):
+    """Token bucket per host, shared with other getmanga processes through lock files"""
+    def __init__(self, rate, burst=1, state_dir=None):
+        """Raises ValueError unless rate is more than 0 requests per second"""
+        rate = float(rate)
+        burst = float(burst)
+        # written so that nan fails too
+        if not rate > 0:
+            raise ValueError("rate limit should be more than 0 requests per second: {0}".format(rate))
+        if not burst >= 0:
+            raise ValueError("rate limit burst should be 0 or more: {0}".format(burst))
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        if state_dir is None:
+            state_dir = os.path.join(tempfile.gettempdir(), 'getmanga-ratelimit')
+        self.state_dir = os.path.expanduser(state_dir)
+        if fcntl and not os.path.isdir(self.state_dir):
+            try:
+                os.makedirs(self.state_dir)
+            except OSError:
+                pass
+
+        self._buckets = {}
+        self._lock = Lock()
+
+    @classmethod
+    def parse(cls, value, state_dir=None):
+        """Returns a limiter from a 'rate[:burst]' string, e.g. 2:5"""
+        rate, _, burst = value.strip().partition(':')
+        try:
+            rate = float(rate)
+            burst = float(burst) if burst else 1
+        except ValueError:
+            raise ValueError("invalid rate limit '{0}', expected rate[:burst]".format(value))
+        return cls(rate, burst, state_dir)
+
+    def wait(self, uri):
+        """Blocks until a request to the host of uri is allowed"""
+        host = urlparse(uri).netloc
+        while True:
+            delay = self._take(host)
+            if delay <= 0:
+                return
+            sleep(delay)
+
+    def _take(self, host):
+        """Takes a token from the host's bucket, returns seconds to wait if empty"""
+        with self._lock:
+            state_file = self._state_file(host)
+            if state_file is None:
+                tokens, last = self._buckets.get(host, (self.burst, time()))
+                tokens, delay = self._refill(tokens, last)
+                self._buckets[host] = (tokens, time())
+                return delay
+
+            with open(state_file, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        tokens, last = [float(x) for x in f.read().split()]
+                    except ValueError:
+                        tokens, last = self.burst, time()
+                    tokens, delay = self._refill(tokens, last)
+                    f.seek(0)
+                    f.truncate()
+                    f.write('{0!r} {1!r}'.format(tokens, time()))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            return delay
+
+    def _refill(self, tokens, last):
+        """Returns (tokens left, delay) after adding tokens earned since last"""
+        tokens = min(self.burst, tokens + max(time() - last, 0) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, 0
+        return tokens, (1 - tokens) / self.rate
+
+    def _state_file(self, host):
+        """Returns the file holding the host's bucket, or None without lock files"""
+        if not (fcntl and os.path.isdir(self.state_dir)):
+            return None
+        return os.path.join(self.state_dir, re.sub(r'[^A-Za-z0-9.-]', '_', host))
@@ -0,0 +1,57 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import random
+from email.utils import mktime_tz, parsedate_tz
+from threading import Lock
+from time import time
+
+
+class RetryPolicy(object):
+    """Decides whether and how long to wait before trying a request again"""
+    # throttling and server side trouble, anything else is final
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, attempts=5, backoff=1.0, max_backoff=60, budget=120, timeout=30):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # seconds a request may take including all its retries
+        self.budget = budget
+        # seconds to wait for a single response
+        self.timeout = timeout
+
+        self.retries = {}
+        self._lock = Lock()
+
+    def delay(self, attempt, resp=None):
+        """Returns seconds to wait before retry number attempt (starting at 1)"""
+        retry_after = self._retry_after(resp)
+        if retry_after is not None:
+            return retry_after
+        # exponential backoff with full jitter, so clients don't retry in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def count(self, site):
+        """Counts a retry against site"""
+        with self._lock:
+            self.retries[site] = self.retries.get(site, 0) + 1
+
+    @staticmethod
+    def _retry_after(resp):
+        """Returns the delay asked by the server's Retry-After header, or None"""
+        if resp is None or resp.status_code not in (429, 503):
+            return None
+        value = resp.headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(mktime_tz(date) - time(), 0)
@@ -0,0 +1,123 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import atexit
+import multiprocessing
+import os
+from io import BytesIO
+from threading import Lock
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from getmanga import MangaException
+
+
+# format name -> (name Pillow saves it as, file extension)
+FORMATS = {'jpeg': ('JPEG', 'jpg'),
+           'png': ('PNG', 'png'),
+           'webp': ('WEBP', 'webp')}
+
+
+class Transcoder(object):
+    """Re-encodes and downscales page images in a pool of processes, one per
+    core by default; images already in the format and size asked for are
+    left as they are"""
+    def __init__(self, image_format=None, quality=80, max_width=None, max_height=None, processes=None):
+        if Image is None:
+            raise MangaException("transcoding pages needs Pillow (pip install Pillow)")
+        if image_format is not None and image_format not in FORMATS:
+            raise MangaException("unknown image format: {0}".format(image_format))
+        self.image_format = image_format
+        self.quality = quality
+        self.max_width = max_width
+        self.max_height = max_height
+        self.processes = processes or multiprocessing.cpu_count()
+
+        self._pool = None
+        self._lock = Lock()
+
+    @staticmethod
+    def parse_size(value):
+        """Returns (width, height) of a size like 1072x1448, x1448 or 1072x,
+        None for no limit. Raises ValueError if it isn't one"""
+        width, sep, height = value.lower().partition('x')
+        if not sep:
+            raise ValueError("image size should look like 1072x1448: {0}".format(value))
+        width = int(width) if width.strip() else None
+        height = int(height) if height.strip() else None
+        return (width or None, height or None)
+
+    def transcode(self, name, image):
+        """Re-encodes the image file in place, returns (page name with the new
+        extension, 'done'), or (name, 'skipped' or 'failed') if it's unchanged"""
+        image.seek(0)
+        data = image.read()
+        image.seek(0)
+        try:
+            converted = self._get_pool().apply(_transcode, (data, self.image_format, self.quality,
+                                                            self.max_width, self.max_height))
+        except Exception:
+            # not something Pillow reads, the page goes in as it is
+            return (name, 'failed')
+        if converted is None:
+            return (name, 'skipped')
+        data, extension = converted
+        image.truncate()
+        image.write(data)
+        image.seek(0)
+        return ('{0}{1}{2}'.format(os.path.splitext(name)[0], os.path.extsep, extension), 'done')
+
+    def close(self):
+        """Stops the processes"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # forking a process full of download threads can copy their
+                # held locks into the children, start fresh ones where we can
+                if hasattr(multiprocessing, 'get_context'):
+                    self._pool = multiprocessing.get_context('spawn').Pool(self.processes)
+                else:
+                    self._pool = multiprocessing.Pool(self.processes)
+                atexit.register(self.close)
+            return self._pool
+
+
+def _transcode(data, image_format, quality, max_width, max_height):
+    """Returns (data, file extension) of an image re-encoded as asked, None
+    if it already is what was asked for. Runs in a pool process"""
+    image = Image.open(BytesIO(data))
+    current = (image.format or '').lower()
+    width, height = image.size
+    too_big = (max_width and width > max_width) or (max_height and height > max_height)
+    if not too_big and image_format in (None, current):
+        return None
+    if getattr(image, 'is_animated', False):
+        # only the first frame would be left
+        return None
+
+    image_format = image_format or current
+    if image_format not in FORMATS:
+        # resizing a gif or bmp, save it as png
+        image_format = 'png'
+    if too_big:
+        image.thumbnail((max_width or width, max_height or height), Image.LANCZOS)
+    if image_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    elif image_format == 'webp' and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+
+    out = BytesIO()
+    pil_format, extension = FORMATS[image_format]
+    image.save(out, pil_format, quality=quality)
+    return (out.getvalue(), extension)
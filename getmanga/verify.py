@@ -0,0 +1,118 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import mmap
+import multiprocessing
+import os
+import struct
+import zlib
+from io import BytesIO
+from zipfile import BadZipfile, ZipFile
+
+from getmanga import image_type
+
+
+def find_archives(path):
+    """Yields every archive under path"""
+    for root, _, files in os.walk(os.path.expanduser(path)):
+        for name in sorted(files):
+            if os.path.splitext(name)[1] == os.path.extsep + 'cbz':
+                yield os.path.join(root, name)
+
+
+def verify(path, processes=None):
+    """Yields (archive, what is wrong with it) of every archive under path,
+    None for those that are fine, checking one archive per core at a time"""
+    if hasattr(multiprocessing, 'get_context'):
+        pool = multiprocessing.get_context('spawn').Pool(processes)
+    else:
+        pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(check_archive, find_archives(path), 8):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def check_archive(cbz_file):
+    """Returns (cbz_file, what is wrong with it), None if every page is there
+    with the right crc and looks like a whole image"""
+    try:
+        with open(cbz_file, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return (cbz_file, 'empty file')
+            # the pages are read straight from the page cache
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                cbz = ZipFile(MappedFile(data))
+                pages = 0
+                for zinfo in cbz.infolist():
+                    if zinfo.filename.endswith('/'):
+                        continue
+                    # reading the whole entry checks its crc
+                    problem = check_image(cbz.read(zinfo))
+                    if problem is not None:
+                        return (cbz_file, '{0}: {1}'.format(zinfo.filename, problem))
+                    pages += 1
+                cbz.close()
+            finally:
+                data.close()
+    except (IOError, OSError, BadZipfile, EOFError, ValueError, zlib.error) as msg:
+        return (cbz_file, str(msg) or msg.__class__.__name__)
+    if not pages:
+        return (cbz_file, 'no pages')
+    return (cbz_file, None)
+
+
+class MappedFile(object):
+    """Read only file over a memory map, the parts ZipFile uses"""
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+
+    def read(self, size=-1):
+        end = len(self._data)
+        if size is not None and size >= 0:
+            end = min(self._position + size, end)
+        chunk = self._data[self._position:end]
+        self._position = max(end, self._position)
+        return chunk
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += len(self._data)
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+    def seekable(self):
+        return True
+
+
+def check_image(data):
+    """Returns what is wrong with a page image, None if it looks whole. Only
+    jpeg, png, gif and webp can be told apart from noise"""
+    if not data:
+        return 'empty page'
+    kind = image_type(BytesIO(data[:12]))
+    if kind == 'jpeg':
+        # end of image marker, some encoders leave padding after it
+        if data.rfind(b'\xff\xd9', -1024) == -1:
+            return 'truncated jpeg'
+    elif kind == 'png':
+        if data.rfind(b'IEND', -32) == -1:
+            return 'truncated png'
+    elif kind == 'gif':
+        if not data.rstrip(b'\x00').endswith(b';'):
+            return 'truncated gif'
+    elif kind == 'webp':
+        if len(data) < struct.unpack('<I', data[4:8])[0] + 8:
+            return 'truncated webp'
+    return None
@@ -0,0 +1,68 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+from threading import Lock
+from time import time
+
+
+class Schedule(object):
+    """When to check each title next; titles that update often are checked
+    more often, titles that don't drift towards max_interval"""
+    def __init__(self, min_interval=600, max_interval=86400):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        # key -> [next check, interval, newest chapter seen]
+        self._titles = {}
+        self._lock = Lock()
+
+    def update(self, keys):
+        """Starts checking keys that are new, right away, and stops checking
+        those that aren't in keys anymore"""
+        keys = set(keys)
+        with self._lock:
+            for key in list(self._titles):
+                if key not in keys:
+                    del self._titles[key]
+            for key in keys:
+                if key not in self._titles:
+                    self._titles[key] = [0, self.min_interval, None]
+
+    def due(self, now=None):
+        """Returns the keys that should be checked now, longest waiting first"""
+        now = time() if now is None else now
+        with self._lock:
+            due = [(entry[0], key) for key, entry in self._titles.items() if entry[0] <= now]
+        return [key for _, key in sorted(due)]
+
+    def wait(self, now=None):
+        """Returns seconds until the next check is due, None without titles"""
+        now = time() if now is None else now
+        with self._lock:
+            if not self._titles:
+                return None
+            return max(min(entry[0] for entry in self._titles.values()) - now, 0)
+
+    def done(self, key, latest, now=None):
+        """Schedules the next check of key, latest is the newest chapter it
+        has now (None if the check failed)"""
+        now = time() if now is None else now
+        with self._lock:
+            entry = self._titles.get(key)
+            if entry is None:
+                return
+            if latest is not None and entry[2] is not None and latest != entry[2]:
+                # updated since the last check, look again sooner
+                entry[1] = max(entry[1] / 2.0, self.min_interval)
+            elif entry[2] is not None or latest is None:
+                entry[1] = min(entry[1] * 1.5, self.max_interval)
+            if latest is not None:
+                entry[2] = latest
+            entry[0] = now + entry[1]
+
+    def interval(self, key):
+        """Returns the current check interval of key in seconds"""
+        with self._lock:
+            return self._titles[key][1]
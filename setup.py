@@ -23,6 +23,7 @@ setup(name='getmanga',
       packages=['getmanga'],
       zip_safe=False,
       install_requires=['requests', 'lxml', 'cssselect'],
+      extras_require={'transcode': ['Pillow']},
       entry_points="""
       [console_scripts]
       getmanga = getmanga.cli:main
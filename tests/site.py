@@ -0,0 +1,42 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import re
+
+from getmanga import SITES, MangaHere
+
+
+class FakeSite(MangaHere):
+    """MangaHere without the network, chapters and pages are made up"""
+    site_uri = "http://fake.invalid"
+    threadless = False
+
+    num_chapters = 3
+    num_pages = 4
+
+    def _get_html(self, uri, cache=False):
+        chapter = re.search(r'/c([0-9]+)/$', uri)
+        if chapter:
+            options = ''.join('<option>{0}</option>'.format(n) for n in range(1, self.num_pages + 1))
+            return ('<section class="readpage_top"><div class="go_page"><select>{0}'
+                    '</select></div></section>'.format(options))
+        links = ''.join('<li><a href="/manga/{0}/c{1:03d}/">{0} {1}</a></li>'.format(self.title, n)
+                        for n in range(self.num_chapters, 0, -1))
+        return '<div class="detail_list"><ul>{0}</ul></div>'.format(links)
+
+    def get_image_uri(self, page_uri):
+        return page_uri.replace('.html', '.jpg')
+
+    def download(self, image_uri, page_uri, fileobj=None):
+        fileobj.write(self.image(image_uri))
+        return fileobj
+
+    @staticmethod
+    def image(image_uri):
+        """Returns the bytes served for image_uri"""
+        return b'\xff\xd8\xff\xe0' + image_uri.encode('utf8') * 64 + b'\xff\xd9'
+
+
+SITES.setdefault('fakesite', FakeSite)
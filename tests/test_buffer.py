@@ -0,0 +1,51 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import unittest
+
+from getmanga import PageBuffer
+
+
+class PageBufferTest(unittest.TestCase):
+    def setUp(self):
+        # 1000 bytes for pages waiting to be written, spooled up to 500
+        self.buffer = PageBuffer(2000, 2)
+
+    def page(self, size, position=None):
+        image = self.buffer.spool()
+        image.write(b'x' * size)
+        if position is not None:
+            image.seek(position)
+        return image
+
+    def test_counted_until_released(self):
+        pages = [self.page(300), self.page(400, position=0)]
+        for image in pages:
+            self.buffer.keep(image)
+        self.assertEqual([self.buffer.buffered(image) for image in pages], [300, 400])
+        self.assertEqual(self.buffer.used, 700)
+        # kept pages are read from the start
+        self.assertEqual(pages[1].tell(), 0)
+
+        for image in pages:
+            self.buffer.release(image)
+        self.assertEqual(self.buffer.used, 0)
+
+    def test_over_limit_on_disk(self):
+        pages = [self.page(600), self.page(450), self.page(450), self.page(450)]
+        for image in pages:
+            self.buffer.keep(image)
+        # bigger than spool_size, and past the limit
+        self.assertEqual([self.buffer.buffered(image) for image in pages], [0, 450, 450, 0])
+        self.assertEqual(self.buffer.used, 900)
+        self.assertEqual(pages[3].read(), b'x' * 450)
+
+        for image in pages:
+            self.buffer.release(image)
+        self.assertEqual(self.buffer.used, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import unittest
+
+from getmanga import Chapter
+from getmanga.catalog import ChapterCatalog, parse_selector
+
+
+def chapters(*numbers):
+    """Returns chapters as a site lists them, oldest first; 1 and 2 are volume v01"""
+    return [Chapter(number, 'some_title_c{0}'.format(number), 'uri {0}'.format(number),
+                    'v01' if number in ('1', '2') else None) for number in numbers]
+
+
+class ParseSelectorTest(unittest.TestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_selector('12'), [('12', '12')])
+        self.assertEqual(parse_selector('1-10,15,20-'), [('1', '10'), ('15', '15'), ('20', None)])
+        self.assertEqual(parse_selector(' 1 - 3 , 12.5 '), [('1', '3'), ('12.5', '12.5')])
+        self.assertEqual(parse_selector('extra'), [('extra', 'extra')])
+
+    def test_invalid(self):
+        for selector in ('', ',', '1,', '-5', 'a-5', '1-b', '10-2'):
+            self.assertRaises(ValueError, parse_selector, selector)
+
+
+class ChapterCatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.catalog = ChapterCatalog(chapters('1', '2', 'extra', '3', '4', '5',
+                                               '12', '12.1', '12.5', '13', '20', '21'))
+
+    def select(self, selector):
+        found, missing = self.catalog.select(parse_selector(selector))
+        return [chapter.number for chapter in found], missing
+
+    def test_decimal_parts(self):
+        self.assertEqual(self.select('12'), (['12', '12.1', '12.5'], []))
+        self.assertEqual(self.select('12-13'), (['12', '12.1', '12.5', '13'], []))
+        self.assertEqual([chapter.number for chapter in self.catalog.parts('12')], ['12', '12.1', '12.5'])
+
+    def test_open_ended(self):
+        self.assertEqual(self.select('20-'), (['20', '21'], []))
+        self.assertEqual(self.select('13-'), (['13', '20', '21'], []))
+
+    def test_missing_ends(self):
+        self.assertEqual(self.select('3-50'), ([], [('3', '50')]))
+        self.assertEqual(self.select('6-12'), ([], [('6', '12')]))
+        self.assertEqual(self.select('14-'), ([], [('14', None)]))
+        # the rest is still found
+        self.assertEqual(self.select('1-10,4,20-'), (['4', '20', '21'], [('1', '10')]))
+
+    def test_names(self):
+        self.assertEqual(self.select('extra'), (['extra'], []))
+        self.assertEqual(self.select('bonus'), ([], [('bonus', 'bonus')]))
+        # a range is chapter numbers, not the part of the list between its ends
+        self.assertEqual(self.select('2-3'), (['2', '3'], []))
+
+    def test_duplicates_and_order(self):
+        self.assertEqual(self.select('1-3,2-4,3'), (['1', '2', '3', '4'], []))
+        self.assertEqual(self.select('5,1,extra'), (['1', 'extra', '5'], []))
+
+    def test_volumes(self):
+        self.assertEqual([chapter.number for chapter in self.catalog.volumes(['v01', 'v09'])], ['1', '2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from getmanga import GetManga
+from getmanga.library import DownloadIndex
+from tests.site import FakeSite
+
+
+class DownloadIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.index = DownloadIndex(os.path.join(self.path, 'index.db'))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.path)
+
+    def getmanga(self):
+        manga = GetManga('fakesite', 'some title')
+        manga.path = self.path
+        manga.index = self.index
+        manga.show_progress = False
+        return manga
+
+    def record(self, name):
+        return self.index._db.execute("SELECT title, site, number, pages FROM chapters WHERE name = ?",
+                                      (name,)).fetchone()
+
+    def test_chapter_kept_when_directory_is_first_read(self):
+        # getmanga some_title -c 1, then getmanga some_title new
+        first = self.getmanga()
+        chapter = first.chapters[0]
+        first.get(chapter)
+        self.getmanga().getNewChapters()
+
+        self.assertEqual(self.record(chapter.name), ('some title', 'fakesite', '1', FakeSite.num_pages))
+        self.assertEqual(len(self.index.downloaded(self.path)), FakeSite.num_chapters)
+
+    def test_pages_kept_when_archive_exists(self):
+        manga = self.getmanga()
+        chapter = manga.chapters[0]
+        manga.get(chapter)
+        # downloading it again finds the archive and skips it
+        manga.get(chapter)
+
+        self.assertEqual(self.record(chapter.name)[3], FakeSite.num_pages)
+
+    def test_archive_on_disk_before_index(self):
+        manga = self.getmanga()
+        chapter = manga.chapters[0]
+        manga.index = None
+        manga.get(chapter)
+
+        self.assertEqual(self.index.downloaded(self.path), set([chapter.name]))
+        self.index.sync(self.path, 'some title', 'fakesite')
+        self.assertEqual(self.record(chapter.name), ('some title', 'fakesite', '1', FakeSite.num_pages))
+
+    def test_watermarks_of_titles_in_one_directory(self):
+        self.index.set_watermark(self.path, 'fakesite', 'some title', 'some_title_c003', 'uri 3', 'abc')
+        self.index.set_watermark(self.path, 'fakesite', 'other title', 'other_title_c007', 'uri 7')
+
+        self.assertEqual(self.index.watermark(self.path, 'fakesite', 'some title'),
+                         ('some_title_c003', 'uri 3', 'abc'))
+        self.assertEqual(self.index.watermark(self.path, 'fakesite', 'other title'),
+                         ('other_title_c007', 'uri 7', None))
+        self.assertEqual(self.index.watermark(self.path, 'mangahere', 'some title'), None)
+
+    def test_new_chapters_of_titles_in_one_directory(self):
+        self.getmanga().getNewChapters()
+        other = GetManga('fakesite', 'other title')
+        other.path = self.path
+        other.index = self.index
+        other.show_progress = False
+        other.getNewChapters()
+
+        self.assertEqual(self.getmanga().numNewChapters(), 0)
+        self.assertEqual(self.index.watermark(self.path, 'fakesite', 'some title')[0], 'some_title_c003')
+        self.assertEqual(self.index.watermark(self.path, 'fakesite', 'other title')[0], 'other_title_c003')
+
+    def test_watermarks_of_older_index_dropped(self):
+        self.index.close()
+        db_file = os.path.join(self.path, 'old.db')
+        db = sqlite3.connect(db_file)
+        db.execute("CREATE TABLE watermarks (dir TEXT PRIMARY KEY, site TEXT NOT NULL, "
+                   "name TEXT NOT NULL, uri TEXT NOT NULL, fingerprint TEXT)")
+        db.execute("INSERT INTO watermarks VALUES (?, 'fakesite', 'some_title_c003', 'uri 3', NULL)",
+                   (self.path,))
+        db.commit()
+        db.close()
+
+        self.index = DownloadIndex(db_file)
+        self.assertEqual(self.index.watermark(self.path, 'fakesite', 'some title'), None)
+        self.index.set_watermark(self.path, 'fakesite', 'some title', 'some_title_c003', 'uri 3')
+        self.assertEqual(self.index.watermark(self.path, 'fakesite', 'some title'),
+                         ('some_title_c003', 'uri 3', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import os
+import shutil
+import tempfile
+import unittest
+from threading import Lock
+from time import sleep
+from zipfile import ZipFile
+
+from getmanga import SITES, GetManga, MangaDex, MangaException
+from tests.site import FakeSite
+
+
+class OddPageSite(FakeSite):
+    """FakeSite whose image uris can be guessed, but page 3 is a png"""
+    guess_image_uris = True
+    num_pages = 6
+
+    def get_image_uri(self, page_uri):
+        return self.image_uri(page_uri)
+
+    @staticmethod
+    def image_uri(page_uri):
+        """Returns the image uri of a page, the one download() takes"""
+        uri = page_uri.replace('.html', '.jpg')
+        if uri.endswith('/3.jpg'):
+            return uri[:-len('jpg')] + 'png'
+        return uri
+
+    def download(self, image_uri, page_uri, fileobj=None):
+        if image_uri != self.image_uri(page_uri):
+            raise MangaException("Failed to retrieve {0}".format(image_uri))
+        return FakeSite.download(self, image_uri, page_uri, fileobj)
+
+
+class ThreadlessSite(OddPageSite):
+    """OddPageSite that has to be downloaded from one request at a time,
+    remembers the most requests it had at once"""
+    threadless = True
+    num_chapters = 4
+
+    lock = Lock()
+    requests = 0
+    most_requests = 0
+
+    def _request(self, request, *args):
+        cls = ThreadlessSite
+        with cls.lock:
+            cls.requests += 1
+            cls.most_requests = max(cls.most_requests, cls.requests)
+        try:
+            sleep(0.002)
+            return request(self, *args)
+        finally:
+            with cls.lock:
+                cls.requests -= 1
+
+    def _get_html(self, uri, cache=False):
+        return self._request(OddPageSite._get_html, uri, cache)
+
+    def get_image_uri(self, page_uri):
+        return self._request(OddPageSite.get_image_uri, page_uri)
+
+    def download(self, image_uri, page_uri, fileobj=None):
+        return self._request(OddPageSite.download, image_uri, page_uri, fileobj)
+
+
+class KeepingTranscoder(object):
+    """Transcoder that leaves pages as they are, with processes of its own"""
+    processes = 2
+
+    def transcode(self, name, image):
+        return (name, 'skipped')
+
+
+class FakeMangaDex(MangaDex):
+    """MangaDex without the network, counts the html fetched"""
+    site_uri = "http://fake.invalid"
+
+    def __init__(self, title):
+        MangaDex.__init__(self, title)
+        self.fetched = []
+
+    def _get_html(self, uri, cache=False):
+        self.fetched.append(uri)
+        return ('<select id="jump_page"><option value="1">Page 1</option>'
+                '<option value="2">Page 2</option></select>'
+                "<script>var server = '/data/'; var dataurl = 'abc';"
+                "var page_array = ['x1.png', 'x2.png'];</script>")
+
+
+class PagesTest(unittest.TestCase):
+    def setUp(self):
+        SITES.setdefault('oddpagesite', OddPageSite)
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_wrong_guess_asks_the_page(self):
+        manga = GetManga('oddpagesite', 'some title')
+        manga.path = self.path
+        manga.show_progress = False
+        manga.get(manga.chapters[0])
+
+        with ZipFile(manga.path + '/some_title_c001.cbz') as cbz:
+            self.assertEqual(sorted(cbz.namelist()),
+                             ['001.jpg', '002.jpg', '003.png', '004.jpg', '005.jpg', '006.jpg'])
+
+    def test_threadless_site_gets_one_request_at_a_time(self):
+        SITES.setdefault('threadlesssite', ThreadlessSite)
+        manga = GetManga('threadlesssite', 'some title')
+        manga.path = self.path
+        manga.show_progress = False
+        manga.transcoder = KeepingTranscoder()
+        ThreadlessSite.most_requests = 0
+        manga.getChapters(manga.chapters)
+
+        self.assertEqual(len(os.listdir(self.path)), ThreadlessSite.num_chapters)
+        self.assertEqual(ThreadlessSite.most_requests, 1)
+
+    def test_mangadex_reads_chapter_once(self):
+        manga = FakeMangaDex('some title:123')
+        chapter_uri = 'http://fake.invalid/chapter/1'
+        pages = manga.get_pages(chapter_uri)
+
+        self.assertEqual(manga.get_image_uris(chapter_uri, pages),
+                         ['http://fake.invalid/data/abc/x1.png', 'http://fake.invalid/data/abc/x2.png'])
+        self.assertEqual(manga.fetched, [chapter_uri])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import shutil
+import tempfile
+import unittest
+
+from getmanga.ratelimit import RateLimiter
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def test_parse(self):
+        limiter = RateLimiter.parse(' 2:5 ', self.state_dir)
+        self.assertEqual((limiter.rate, limiter.burst), (2.0, 5.0))
+        limiter = RateLimiter.parse('0.5', self.state_dir)
+        self.assertEqual((limiter.rate, limiter.burst), (0.5, 1.0))
+
+    def test_parse_rejects_invalid(self):
+        for value in ('0', '-1', '0:5', 'nan', 'fast', '2:many', '2:-1', ''):
+            self.assertRaises(ValueError, RateLimiter.parse, value, self.state_dir)
+
+    def test_burst_then_wait(self):
+        limiter = RateLimiter.parse('1000:2', self.state_dir)
+        for _ in range(4):
+            limiter.wait('http://fake.invalid/manga/')
+
+
+if __name__ == '__main__':
+    unittest.main()
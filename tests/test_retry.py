@@ -0,0 +1,150 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import random
+import unittest
+from email.utils import formatdate
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import getmanga
+from getmanga import MangaException
+from getmanga.retry import RetryPolicy
+from tests.site import FakeSite
+
+
+class Response(object):
+    """What _get looks at of a requests response"""
+    raw = None
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers or {})
+
+
+class Session(object):
+    """Answers each get with the next of responses, exceptions are raised"""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    def get(self, uri, **kwargs):
+        self.requests += 1
+        resp = self.responses.pop(0)
+        if isinstance(resp, Exception):
+            raise resp
+        return resp
+
+
+class StubSite(FakeSite):
+    """FakeSite whose requests go to a stub session"""
+    stub = None
+
+    @property
+    def session(self):
+        return self.stub
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_backoff_bounds(self):
+        policy = RetryPolicy(backoff=1.0, max_backoff=10)
+        random.seed(8)
+        for attempt in range(1, 10):
+            limit = min(10, 2 ** (attempt - 1))
+            delays = [policy.delay(attempt) for _ in range(200)]
+            self.assertTrue(all(0 <= delay <= limit for delay in delays))
+            # full jitter, not always the top
+            self.assertTrue(min(delays) < limit / 2.0)
+
+    def test_retry_after_seconds(self):
+        policy = RetryPolicy(backoff=0.001, max_backoff=0.001)
+        self.assertEqual(policy.delay(1, Response(429, {'Retry-After': '7'})), 7)
+        self.assertEqual(policy.delay(1, Response(503, {'retry-after': '2.5'})), 2.5)
+        self.assertEqual(policy.delay(1, Response(503, {'Retry-After': '-3'})), 0)
+        # only throttling answers are listened to
+        self.assertTrue(policy.delay(1, Response(500, {'Retry-After': '7'})) <= 0.001)
+        self.assertTrue(policy.delay(1, Response(429)) <= 0.001)
+
+    def test_retry_after_date(self):
+        policy = RetryPolicy(backoff=0.001, max_backoff=0.001)
+        future = formatdate(getmanga.time() + 30, usegmt=True)
+        self.assertTrue(28 <= policy.delay(1, Response(429, {'Retry-After': future})) <= 30.5)
+        past = formatdate(getmanga.time() - 30, usegmt=True)
+        self.assertEqual(policy.delay(1, Response(503, {'Retry-After': past})), 0)
+        self.assertTrue(policy.delay(1, Response(429, {'Retry-After': 'soon'})) <= 0.001)
+
+
+class GetTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = 1000.0
+        self.slept = []
+        self.time, self.sleep = getmanga.time, getmanga.sleep
+        getmanga.time = lambda: self.clock
+        getmanga.sleep = self.fake_sleep
+        self.site = StubSite('some title')
+        self.site.retry_policy = RetryPolicy(attempts=4, backoff=1.0, max_backoff=8, budget=60)
+
+    def tearDown(self):
+        getmanga.time, getmanga.sleep = self.time, self.sleep
+
+    def fake_sleep(self, seconds):
+        self.slept.append(seconds)
+        self.clock += seconds
+
+    def get(self, responses, **kwargs):
+        self.site.stub = Session(responses)
+        return self.site._get('http://fake.invalid/page', **kwargs)
+
+    def test_retried_statuses(self):
+        for status in RetryPolicy.retry_statuses:
+            self.slept = []
+            resp = self.get([Response(status, {'Retry-After': '1'}), Response(200)])
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(self.site.stub.requests, 2)
+            self.assertEqual(len(self.slept), 1)
+
+    def test_final_statuses(self):
+        for status in (200, 301, 400, 403, 404, 410):
+            resp = self.get([Response(status), Response(200)])
+            self.assertEqual(resp.status_code, status)
+            self.assertEqual(self.site.stub.requests, 1)
+        self.assertEqual(self.slept, [])
+
+    def test_attempts(self):
+        resp = self.get([Response(502)] * 10)
+        self.assertEqual(resp.status_code, 502)
+        self.assertEqual(self.site.stub.requests, 4)
+        self.assertEqual(len(self.slept), 3)
+        self.get([Response(502)] * 10, attempts=2)
+        self.assertEqual(self.site.stub.requests, 2)
+
+    def test_connection_errors(self):
+        resp = self.get([requests.ConnectionError("refused"), Response(200)])
+        self.assertEqual(resp.status_code, 200)
+        self.assertRaises(MangaException, self.get, [requests.Timeout("slow")] * 10)
+        self.assertEqual(self.site.stub.requests, 4)
+
+    def test_budget(self):
+        # 30 + 30 fits in 60 seconds, a third wait doesn't
+        resp = self.get([Response(429, {'Retry-After': '30'})] * 10)
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(self.slept, [30, 30])
+        self.assertEqual(self.site.stub.requests, 3)
+        # a wait longer than the budget isn't even started
+        self.slept = []
+        self.get([Response(503, {'Retry-After': '90'}), Response(200)])
+        self.assertEqual(self.slept, [])
+        self.assertEqual(self.site.stub.requests, 1)
+
+    def test_invalid_response_retried(self):
+        answers = [False, True]
+        resp = self.get([Response(200), Response(200)], validate=lambda resp: answers.pop(0))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.site.stub.requests, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+
+from getmanga import SITES, GetManga, PageBuffer
+from getmanga.transcode import Image, Transcoder
+from tests.site import FakeSite
+
+
+class PngSite(FakeSite):
+    """FakeSite serving real png pages"""
+    @staticmethod
+    def image(image_uri):
+        page = Image.new('RGB', (64, 96), (len(image_uri) % 256, 128, 32))
+        out = BytesIO()
+        page.save(out, 'PNG')
+        return out.getvalue()
+
+
+class KeptBuffer(PageBuffer):
+    """PageBuffer that remembers (bytes counted, file size) of every page it kept"""
+    def __init__(self, limit, workers):
+        PageBuffer.__init__(self, limit, workers)
+        self.kept = []
+
+    def keep(self, image):
+        PageBuffer.keep(self, image)
+        image.seek(0, 2)
+        self.kept.append((self.buffered(image), image.tell()))
+        image.seek(0)
+
+
+@unittest.skipIf(Image is None, "transcoding pages needs Pillow")
+class TranscodeBufferTest(unittest.TestCase):
+    def setUp(self):
+        SITES.setdefault('pngsite', PngSite)
+        self.path = tempfile.mkdtemp()
+        self.transcoder = Transcoder('jpeg', max_width=32, processes=1)
+
+    def tearDown(self):
+        self.transcoder.close()
+        shutil.rmtree(self.path)
+
+    def download(self, memory_limit):
+        manga = GetManga('pngsite', 'some title')
+        manga.path = self.path
+        manga.show_progress = False
+        manga.transcoder = self.transcoder
+        manga.memory_limit = memory_limit
+        manga.buffer = KeptBuffer(memory_limit, 1)
+        manga.get(manga.chapters[0])
+        return manga.buffer
+
+    def test_transcoded_pages_are_counted(self):
+        buffer = self.download(64 * 1024 * 1024)
+
+        self.assertEqual(len(buffer.kept), PngSite.num_pages)
+        for (buffered, size) in buffer.kept:
+            self.assertTrue(size > 0)
+            self.assertEqual(buffered, size)
+        self.assertEqual(buffer.used, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
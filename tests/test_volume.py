@@ -0,0 +1,162 @@
+# -*- coding: utf8 -*-
+# Copyright (c) 2017 wenli
+# Released subject to the MIT License.
+# Please see http://en.wikipedia.org/wiki/MIT_License
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from zipfile import ZipFile
+
+import getmanga
+from getmanga import SITES, GetManga, MangaException
+from tests.site import FakeSite
+
+
+class VolumeSite(FakeSite):
+    """FakeSite whose chapters are all in volume v01, page 3 of chapters in
+    broken fails"""
+    broken = set()
+
+    def _get_chapter_volume(self, location):
+        return 'v01'
+
+    def download(self, image_uri, page_uri, fileobj=None):
+        for chapter in self.broken:
+            if image_uri.endswith('/c{0:03d}/3.jpg'.format(chapter)):
+                raise MangaException("Failed to retrieve {0}".format(image_uri))
+        return FakeSite.download(self, image_uri, page_uri, fileobj)
+
+
+class VolumeTest(unittest.TestCase):
+    def setUp(self):
+        SITES.setdefault('volumesite', VolumeSite)
+        VolumeSite.broken = set()
+        self.path = tempfile.mkdtemp()
+        self.volume_file = os.path.join(self.path, 'some_title_v01.cbz')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def download(self, numbers):
+        manga = GetManga('volumesite', 'some title')
+        manga.path = self.path
+        manga.show_progress = False
+        manga.by_volume = True
+        manga.getChapters([chapter for chapter in manga.chapters if chapter.number in numbers])
+
+    def entries(self, cbz_file):
+        with ZipFile(cbz_file) as cbz:
+            self.assertEqual(cbz.testzip(), None)
+            return cbz.namelist()
+
+    def test_chapters_added_to_volume(self):
+        self.download(['1'])
+        self.download(['2', '3'])
+
+        entries = self.entries(self.volume_file)
+        self.assertEqual(len(entries), 3 * FakeSite.num_pages)
+        self.assertEqual(entries[-1], 'some_title_v01_c003/004.jpg')
+        self.assertEqual(sorted(os.listdir(self.path)), ['some_title_v01.cbz'])
+
+    def test_failed_chapter_keeps_only_its_pages(self):
+        self.download(['1'])
+        with open(self.volume_file, 'rb') as f:
+            volume = f.read()
+        VolumeSite.broken = set([2])
+        self.assertRaises(MangaException, self.download, ['2'])
+
+        with open(self.volume_file, 'rb') as f:
+            self.assertEqual(f.read(), volume)
+        part_file = os.path.join(self.path, 'some_title_v01_c002.cbz.part')
+        entries = self.entries(part_file)
+        # pages 1 and 2, and 4 unless it was cancelled before it was done
+        self.assertTrue(2 <= len(entries) < FakeSite.num_pages)
+        self.assertTrue(all(entry.startswith('some_title_v01_c002/') for entry in entries))
+
+        VolumeSite.broken = set()
+        self.download(['2'])
+        self.assertEqual(len(self.entries(self.volume_file)), 2 * FakeSite.num_pages)
+        self.assertFalse(os.path.exists(part_file))
+
+    def fail_append(self, fail):
+        """Makes the third entry copied into the volume call fail()"""
+        read_entry = getmanga._read_entry
+        copied = []
+
+        def failing_read_entry(f, zinfo):
+            copied.append(zinfo.filename)
+            if len(copied) == 3:
+                fail()
+            return read_entry(f, zinfo)
+
+        getmanga._read_entry = failing_read_entry
+        return read_entry
+
+    def test_failed_append_leaves_volume_as_it_was(self):
+        self.download(['1'])
+        with open(self.volume_file, 'rb') as f:
+            volume = f.read()
+
+        def fail():
+            raise IOError("No space left on device")
+        read_entry = self.fail_append(fail)
+        try:
+            self.assertRaises(MangaException, self.download, ['2'])
+        finally:
+            getmanga._read_entry = read_entry
+
+        with open(self.volume_file, 'rb') as f:
+            self.assertEqual(f.read(), volume)
+        part_file = os.path.join(self.path, 'some_title_v01_c002.cbz.part')
+        self.assertEqual(len(self.entries(part_file)), FakeSite.num_pages)
+        with open(part_file + '.json') as f:
+            self.assertEqual(len(json.load(f)['pages']), FakeSite.num_pages)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs fork")
+    def test_killed_append_leaves_volume_as_it_was(self):
+        self.download(['1'])
+        with open(self.volume_file, 'rb') as f:
+            volume = f.read()
+
+        pid = os.fork()
+        if pid == 0:
+            # nothing after the kill runs, not even finally blocks
+            self.fail_append(lambda: os._exit(1))
+            try:
+                self.download(['2'])
+            finally:
+                os._exit(0)
+        self.assertEqual(os.waitpid(pid, 0)[1] >> 8, 1)
+
+        with open(self.volume_file, 'rb') as f:
+            self.assertEqual(f.read(), volume)
+        self.download(['2'])
+        self.assertEqual(len(self.entries(self.volume_file)), 2 * FakeSite.num_pages)
+
+    def test_deflated_pages_copied_as_they_are(self):
+        manga = GetManga('volumesite', 'some title')
+        manga.path = self.path
+        manga.show_progress = False
+        manga.by_volume = True
+        manga.compression = 'deflate'
+        chapters = manga.chapters
+        manga.get(chapters[0])
+        manga.get(chapters[1])
+
+        with ZipFile(self.volume_file) as cbz:
+            self.assertEqual(cbz.testzip(), None)
+            infos = cbz.infolist()
+            self.assertEqual(len(infos), 2 * FakeSite.num_pages)
+            for zinfo in infos:
+                self.assertTrue(zinfo.compress_size < zinfo.file_size)
+                (chapter, page) = re.search(r'_c([0-9]+)/([0-9]+)', zinfo.filename).groups()
+                image_uri = 'http://fake.invalid/manga/some_title/c{0}/{1}.jpg'.format(chapter, int(page))
+                self.assertEqual(cbz.read(zinfo), VolumeSite.image(image_uri))
+
+
+if __name__ == '__main__':
+    unittest.main()